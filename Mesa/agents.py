@@ -1,8 +1,27 @@
-import random
+import logging
 import mesa
 
 import networkx as nx
 
+from occupancy import BLOCKED, CAR, FREE_PARKING, OBSTACLE, RED_LIGHT, RED_SIDEWALK
+from roadgrid import DIRECTION_OFFSETS
+import simlog
+
+# Silencioso por defecto; simlog.configure_logging() muestra los mensajes
+log = logging.getLogger("traffic.agents")
+
+# Acciones que devuelve propose_move y aplica commit_move
+MOVE = "move"
+PARK = "park"
+WAIT = "wait"
+INVALID = "invalid"
+
+
+def blocking_flags(ignore_cars, flags=BLOCKED | OBSTACLE):
+    """Banderas de Occupancy que impiden entrar a una celda; con ignore_cars sin contar coches"""
+    return flags & ~CAR if ignore_cars else flags
+
+
 class StreetGraph:
     def __init__(self, model):
         self.graph = nx.DiGraph()  # Cambiado a DiGraph para respetar direcciones
@@ -11,32 +30,100 @@ class StreetGraph:
     
     def build_graph(self):
         # Añadir todas las celdas de calle como nodos
-        for pos, direction in self.model.street_directions.items():
-            self.graph.add_node(pos)
-            
-            # Añadir aristas según la dirección permitida
-            x, y = pos
-            if direction == "right" and (x+1, y) in self.model.street_directions:
-                self.graph.add_edge(pos, (x+1, y), weight=1)
-            elif direction == "left" and (x-1, y) in self.model.street_directions:
-                self.graph.add_edge(pos, (x-1, y), weight=1)
-            elif direction == "up" and (x, y+1) in self.model.street_directions:
-                self.graph.add_edge(pos, (x, y+1), weight=1)
-            elif direction == "down" and (x, y-1) in self.model.street_directions:
-                self.graph.add_edge(pos, (x, y-1), weight=1)
+        for pos in self.model.street_directions:
+            self.add_street_edges(pos)
         
         # Añadir conexiones con estacionamientos
-        for agent in self.model.schedule.agents:
-            if isinstance(agent, ParkingAgent):
-                self.graph.add_node(agent.pos)
-                # Conectar con celdas de calle adyacentes
-                x, y = agent.pos
-                neighbors = [(x+1, y), (x-1, y), (x, y+1), (x, y-1)]
-                for neighbor in neighbors:
-                    if neighbor in self.model.street_directions:
-                        self.graph.add_edge(neighbor, agent.pos, weight=1)
+        self.parking_positions = set()
+        for pos in self.model.parkings_by_pos:
+            self.parking_positions.add(pos)
+            self.graph.add_node(pos)
+            # Conectar con celdas de calle adyacentes
+            x, y = pos
+            neighbors = [(x+1, y), (x-1, y), (x, y+1), (x, y-1)]
+            for neighbor in neighbors:
+                if neighbor in self.model.street_directions:
+                    self.graph.add_edge(neighbor, pos, weight=1)
+
+    def add_street_edges(self, pos):
+        """Añade el nodo de una celda de calle y su arista según la dirección permitida"""
+        self.graph.add_node(pos)
+        # Solo las celdas con una única dirección tienen arista de salida
+        move = self.model.street_directions.single_move(pos)
+        if move:
+            next_pos = (pos[0] + move[0], pos[1] + move[1])
+            if next_pos in self.model.street_directions:
+                self.graph.add_edge(pos, next_pos, weight=1)
+
+    def update_cell(self, pos):
+        """Actualiza solo las aristas que tocan una celda cuya dirección cambió,
+        sin reconstruir todo el grafo."""
+        if pos in self.graph and pos not in self.parking_positions:
+            self.graph.remove_node(pos)
+        if pos in self.model.street_directions:
+            self.add_street_edges(pos)
+
+        x, y = pos
+        for neighbor in [(x+1, y), (x-1, y), (x, y+1), (x, y-1)]:
+            if neighbor in self.parking_positions:
+                if pos in self.model.street_directions:
+                    self.graph.add_edge(pos, neighbor, weight=1)
+            elif neighbor in self.model.street_directions:
+                # La celda vecina puede apuntar hacia la celda modificada
+                if self.graph.has_node(neighbor):
+                    self.graph.remove_edges_from(list(self.graph.out_edges(neighbor)))
+                self.add_street_edges(neighbor)
+                vx, vy = neighbor
+                for parking in [(vx+1, vy), (vx-1, vy), (vx, vy+1), (vx, vy-1)]:
+                    if parking in self.parking_positions:
+                        self.graph.add_edge(neighbor, parking, weight=1)
     
-    def find_shortest_path(self, start, parking_spots):
+    def find_shortest_path(self, start, parking_spots, multi_target=True):
+        """Camino más corto desde start hasta el estacionamiento más cercano.
+
+        Por defecto hace una sola búsqueda en anchura que se detiene en el primer
+        nivel donde aparece algún estacionamiento; con multi_target=False se
+        calcula un camino por cada estacionamiento como antes.
+        """
+        if not multi_target:
+            return self.find_shortest_path_each(start, parking_spots)
+
+        # En caso de empate gana el estacionamiento que aparece primero en la lista
+        targets = {}
+        for index, parking_spot in enumerate(parking_spots):
+            targets.setdefault(parking_spot, index)
+        if not targets or start not in self.graph:
+            return None, float('inf')
+        if start in targets:
+            return [start], 0
+
+        successors = self.graph.succ
+        parents = {start: None}
+        frontier = [start]
+        distance = 0
+        while frontier:
+            distance += 1
+            next_frontier = []
+            found = None
+            for node in frontier:
+                for neighbor in successors[node]:
+                    if neighbor in parents:
+                        continue
+                    parents[neighbor] = node
+                    next_frontier.append(neighbor)
+                    if neighbor in targets and (found is None or targets[neighbor] < targets[found]):
+                        found = neighbor
+            if found is not None:
+                path = [found]
+                while parents[path[-1]] is not None:
+                    path.append(parents[path[-1]])
+                path.reverse()
+                return path, distance
+            frontier = next_frontier
+
+        return None, float('inf')
+
+    def find_shortest_path_each(self, start, parking_spots):
         min_path = None
         min_distance = float('inf')
         
@@ -61,14 +148,12 @@ class NormalCarAgent(mesa.Agent):
         self.parked = False
         self.estado = "tranquilo"
         self.tiempo_espera = 0
+        # Movimientos que le tocan en el tick actual (modo por etapas)
+        self.move_rounds = 1
 
     def check_available_parkings(self):
         """Cuenta estacionamientos disponibles"""
-        available = sum(
-            1 for agent in self.model.schedule.agents
-            if isinstance(agent, ParkingAgent) and not agent.occupied
-        )
-        return available
+        return self.model.free_parking_count()
 
     def adjust_behavior(self):
         """Ajusta comportamiento según disponibilidad"""
@@ -82,81 +167,92 @@ class NormalCarAgent(mesa.Agent):
                 self.detection_radius = 2
 
     def move(self):
+        intent = self.propose_move()
+        if intent is not None:
+            self.commit_move(*intent)
+
+    def propose_move(self, ignore_cars=False):
+        """Decide el movimiento sin modificar el grid ni la capa de ocupación.
+
+        Devuelve (acción, celda) con acción "move", "park", "wait" o
+        "invalid", o None si el coche no intenta moverse. Con ignore_cars una
+        celda ocupada solo por otro coche no bloquea: el modo por etapas decide
+        después si ese coche la deja libre en la misma ronda.
+        """
         self.adjust_behavior()
         if self.parked:
-            return
-        
-        # Obtener direcciones permitidas
-        directions = self.model.street_directions.get(self.pos)
-        print(f"Coche en {self.pos}, direcciones permitidas: {directions}")
+            return None
 
-        if not directions:
-            print(f"Coche en {self.pos} no tiene dirección válida. Revisar configuración del modelo.")
-            return
+        # Obtener direcciones permitidas como desplazamientos (dirección, dx, dy)
+        moves = self.model.street_directions.moves(self.pos)
+        log.debug("Coche en %s, direcciones permitidas: %s", self.pos, moves)
+
+        if not moves:
+            log.warning("Coche en %s no tiene dirección válida. Revisar configuración del modelo.", self.pos)
+            return None
 
         # Si hay varias opciones, elegir aleatoriamente entre las direcciones permitidas
-        if isinstance(directions, list):
-            direction = self.random.choice(directions)
+        if len(moves) > 1:
+            _, dx, dy = self.random.choice(moves)
         else:
-            direction = directions
+            _, dx, dy = moves[0]
 
         # Generar la próxima posición basada en la dirección elegida
-        next_pos = None
-        if direction == "right":
-            next_pos = (self.pos[0] + 1, self.pos[1])
-        elif direction == "left":
-            next_pos = (self.pos[0] - 1, self.pos[1])
-        elif direction == "up":
-            next_pos = (self.pos[0], self.pos[1] + 1)
-        elif direction == "down":
-            next_pos = (self.pos[0], self.pos[1] - 1)
+        next_pos = (self.pos[0] + dx, self.pos[1] + dy)
 
         # Validar la próxima posición
-        if next_pos and next_pos in self.model.street_directions:
-            cell_contents = self.model.grid.get_cell_list_contents([next_pos])
-            is_obstructed = False
-
-            for agent in cell_contents:
-                if isinstance(agent, TrafficLightAgent) and agent.state == "red":
-                    print(f"Semáforo en {next_pos} está rojo. No hay movimiento.")
-                    is_obstructed = True
-                    self.tiempo_espera += 1
-                    if self.tiempo_espera > 3:
-                        self.estado = "enojado"
-                    break
-
-                if isinstance(agent, SidewalkAgent) and agent.state() == "red":
-                    print(f"Sidewalk en {next_pos} asociado a semáforo rojo. No hay movimiento.")
-                    is_obstructed = True
-                    self.tiempo_espera += 1
-                    if self.tiempo_espera > 3:
-                        self.estado = "enojado"
-                    break
-
-                if isinstance(agent, ParkingAgent) and not agent.occupied:
-                    # Intentar estacionarse
-                    self.park(agent)
-                    return
-
-                if not isinstance(agent, (TrafficLightAgent, SidewalkAgent, ParkingAgent)):
-                    print(f"La celda {next_pos} está ocupada por {type(agent).__name__}. No hay movimiento.")
-                    is_obstructed = True
-                    self.tiempo_espera += 1
-                    if self.tiempo_espera > 3:
-                        self.estado = "enojado"
-                    break
-
-            if not is_obstructed:
-                self.tiempo_espera = 0
-                self.estado = "tranquilo"
-                self.model.grid.move_agent(self, next_pos)
-                self.pos = next_pos
-                print(f"Coche {self.unique_id} se movió a {next_pos}.")
+        if next_pos in self.model.street_directions:
+            # Una sola lectura de la capa de ocupación en lugar de revisar el contenido de la celda
+            flags = self.model.occupancy.flags_at(next_pos)
+
+            if flags & FREE_PARKING:
+                # Intentar estacionarse
+                return PARK, next_pos
+
+            if flags & blocking_flags(ignore_cars):
+                if flags & RED_LIGHT:
+                    log.debug("Semáforo en %s está rojo. No hay movimiento.", next_pos)
+                elif flags & RED_SIDEWALK:
+                    log.debug("Sidewalk en %s asociado a semáforo rojo. No hay movimiento.", next_pos)
+                else:
+                    log.debug("La celda %s está ocupada. No hay movimiento.", next_pos)
+                return WAIT, next_pos
+            return MOVE, next_pos
+
+        log.debug("Movimiento inválido desde %s hacia %s. Revisión de dirección necesaria.", self.pos, next_pos)
+        return INVALID, next_pos
+
+    def commit_move(self, action, next_pos):
+        """Aplica una decisión de propose_move"""
+        if action == PARK:
+            self.park(self.model.parkings_by_pos[next_pos])
+        elif action == MOVE:
+            self.tiempo_espera = 0
+            self.estado = "tranquilo"
+            self.move_to(next_pos)
+            log.debug("Coche %s se movió a %s.", self.unique_id, next_pos)
         else:
-            print(f"Movimiento inválido desde {self.pos} hacia {next_pos}. Revisión de dirección necesaria.")
-            self.tiempo_espera += 1
-            if self.tiempo_espera > 3:
-                self.estado = "enojado"
+            self.wait_turn()
+            if action == WAIT:
+                self.trace(simlog.BLOCKED, next_pos)
+
+    def wait_turn(self):
+        self.tiempo_espera += 1
+        if self.tiempo_espera > 3:
+            self.estado = "enojado"
+
+    def move_to(self, next_pos):
+        """Mueve el coche en el grid y en la capa de ocupación del modelo"""
+        self.model.occupancy.move_car(self.pos, next_pos)
+        self.model.grid.move_agent(self, next_pos)
+        self.pos = next_pos
+        self.trace(simlog.MOVE, next_pos)
+
+    def trace(self, event, pos):
+        """Agrega un evento a la traza binaria del modelo si está activa"""
+        trace = self.model.trace
+        if trace is not None:
+            trace.record(self.model.schedule.steps, self.unique_id, event, pos)
 
     def park(self, parking_agent):
         """Mover al coche al ParkingAgent y marcarlo como estacionado."""
@@ -164,14 +260,15 @@ class NormalCarAgent(mesa.Agent):
             # Si ya está en la posición del parking, estacionar
             self.parked = True
             parking_agent.occupied = True
-            print(f"Coche {self.unique_id} estacionado en {self.pos}.")
+            log.debug("Coche %s estacionado en %s.", self.unique_id, self.pos)
+            self.trace(simlog.PARK, self.pos)
         else:
             # Moverse a la posición del parking
-            self.model.grid.move_agent(self, parking_agent.pos)
-            self.pos = parking_agent.pos
+            self.move_to(parking_agent.pos)
             self.parked = True
             parking_agent.occupied = True
-            print(f"Coche {self.unique_id} ingresó y estacionó en {self.pos}.")
+            log.debug("Coche %s ingresó y estacionó en %s.", self.unique_id, self.pos)
+            self.trace(simlog.PARK, self.pos)
 
 
 
@@ -180,30 +277,36 @@ class NormalCarAgent(mesa.Agent):
         valid_moves = []
         x, y = self.pos
 
-        # Verificar las cuatro direcciones posibles
-        possible_moves = {
-            "right": (x + 1, y),
-            "left": (x - 1, y),
-            "up": (x, y + 1),
-            "down": (x, y - 1),
-        }
-
-        for direction, next_pos in possible_moves.items():
-            if next_pos in self.model.street_directions and self.model.street_directions[next_pos] == direction:
+        # Verificar las cuatro direcciones posibles: la celda vecina debe tener
+        # únicamente la dirección en la que se avanza hacia ella
+        road = self.model.street_directions
+        for dx, dy in DIRECTION_OFFSETS.values():
+            next_pos = (x + dx, y + dy)
+            if road.single_move(next_pos) == (dx, dy):
                 valid_moves.append(next_pos)
 
         if valid_moves:
             # Elegir una posición válida al azar para "divagar"
             next_pos = self.random.choice(valid_moves)
-            self.model.grid.move_agent(self, next_pos)
-            self.pos = next_pos
-            print(f"Coche {self.unique_id} exploró y se movió a {next_pos}.")
+            self.move_to(next_pos)
+            log.debug("Coche %s exploró y se movió a %s.", self.unique_id, next_pos)
 
     def change_lane(self):
         """Cambiar de carril hacia uno adyacente que sea válido y disponible."""
+        adj_pos = self.propose_lane_change()
+        if adj_pos is not None:
+            self.commit_lane_change(adj_pos)
+        else:
+            log.debug("Coche %s no encontró un carril disponible para cambiar desde %s.", self.unique_id, self.pos)
+
+    def propose_lane_change(self):
+        """Primer carril adyacente válido y sin coche, o None"""
         x, y = self.pos
-        direction = self.model.street_directions.get(self.pos)
-        
+        road = self.model.street_directions
+        code = road.code(self.pos)
+        # En celdas con varias direcciones se puede cambiar a un carril con cualquiera de ellas
+        lane_mask = road.code_mask(code) if road.is_multi_code(code) else 0
+
         # Definir posiciones adyacentes (horizontales y verticales)
         adjacent_positions = [
             (x + 1, y),  # Derecha
@@ -211,30 +314,36 @@ class NormalCarAgent(mesa.Agent):
             (x, y + 1),  # Arriba
             (x, y - 1),  # Abajo
         ]
-        
+
         for adj_pos in adjacent_positions:
             # Verificar que el carril sea válido y respete las reglas del modelo
-            if adj_pos in self.model.street_directions:
-                adj_direction = self.model.street_directions.get(adj_pos)
-                
+            adj_code = road.code(adj_pos)
+            if adj_code:
                 # Verificar si es un carril permitido para cambiar
-                if isinstance(direction, list) and adj_direction in direction:
-                    cell_contents = self.model.grid.get_cell_list_contents([adj_pos])
-                    if not any(isinstance(agent, NormalCarAgent) for agent in cell_contents):
-                        self.model.grid.move_agent(self, adj_pos)
-                        self.pos = adj_pos
-                        print(f"Coche {self.unique_id} cambió de carril a {adj_pos}.")
-                        return
-                
+                if lane_mask and not road.is_multi_code(adj_code) and road.code_mask(adj_code) & lane_mask:
+                    if not self.model.occupancy.has_car(adj_pos):
+                        return adj_pos
+
                 # Verificar si el carril tiene la misma dirección que el actual
-                if adj_direction == direction:
-                    cell_contents = self.model.grid.get_cell_list_contents([adj_pos])
-                    if not any(isinstance(agent, NormalCarAgent) for agent in cell_contents):
-                        self.model.grid.move_agent(self, adj_pos)
-                        self.pos = adj_pos
-                        print(f"Coche {self.unique_id} cambió de carril a {adj_pos}.")
-                        return
-        print(f"Coche {self.unique_id} no encontró un carril disponible para cambiar desde {self.pos}.")
+                if adj_code == code:
+                    if not self.model.occupancy.has_car(adj_pos):
+                        return adj_pos
+        return None
+
+    def commit_lane_change(self, adj_pos):
+        self.move_to(adj_pos)
+        log.debug("Coche %s cambió de carril a %s.", self.unique_id, adj_pos)
+        self.trace(simlog.LANE_CHANGE, adj_pos)
+
+    def wants_lane_change(self):
+        return self.estado == "enojado"
+
+    def prepare_step(self):
+        """Primera etapa del modo por etapas: cuántas veces se mueve en este tick"""
+        self.move_rounds = 1
+
+    def finish_step(self):
+        """Última etapa del modo por etapas"""
 
 
 
@@ -248,85 +357,90 @@ class NormalCarAgent(mesa.Agent):
 class DijkstraCarAgent(NormalCarAgent):
     def __init__(self, unique_id, model, start_pos):
         super().__init__(unique_id, model, start_pos)
+        self._path_to_parking = None
+        self._route_target = None
         self.path_to_parking = None
-        self.detection_radius = 3  # Detectar estacionamientos a 3 cuadros de distancia
+        self.detection_radius = model.detection_radius  # Detectar estacionamientos a 3 cuadros de distancia por defecto
         self.estado = "tranquilo"
         self.tiempo_espera = 0
 
+    @property
+    def path_to_parking(self):
+        return self._path_to_parking
+
+    @path_to_parking.setter
+    def path_to_parking(self, path):
+        # Suscribirse al estacionamiento destino para que el modelo avise si lo ocupan
+        if self._route_target is not None:
+            self.model.unwatch_parking(self, self._route_target)
+            self._route_target = None
+        self._path_to_parking = path
+        if path:
+            self._route_target = path[-1]
+            self.model.watch_parking(self, self._route_target)
+
     def detect_parking_spots(self):
-        # Buscar vecinos dentro del radio de detección
-        neighbors = self.model.grid.iter_neighbors(self.pos, moore=False, radius=self.detection_radius)
-        parking_spots = [
-            agent.pos for agent in neighbors
-            if isinstance(agent, ParkingAgent) and not agent.occupied
-        ]
-        return parking_spots
+        # Consultar el índice espacial de estacionamientos libres dentro del radio de detección
+        return self.model.free_parkings_near(self.pos, self.detection_radius)
 
-    def move(self):
+    def propose_move(self, ignore_cars=False):
         if self.parked:
-            return
-        
+            return None
+
         # Detectar estacionamientos dentro del rango
         parking_spots = self.detect_parking_spots()
 
         if parking_spots and not self.path_to_parking:
             # Si hay estacionamientos en el rango, usar Dijkstra para calcular el camino
-            street_graph = StreetGraph(self.model)
-            path, _ = street_graph.find_shortest_path(self.pos, parking_spots)
+            # Tabla precalculada si el modelo la tiene, si no el grafo compartido
+            route_finder = self.model.route_finder
+            path, _ = route_finder.find_shortest_path(self.pos, parking_spots)
             if path:
                 self.path_to_parking = path[1:]  # Guardar el camino
-                print(f"Coche {self.unique_id} detectó estacionamientos y calculó un camino: {self.path_to_parking}")
+                log.debug("Coche %s detectó estacionamientos y calculó un camino: %s", self.unique_id, self.path_to_parking)
+                self.trace(simlog.ROUTE, path[-1])
             else:
-                print(f"Coche {self.unique_id} no encontró un camino válido hacia estacionamientos.")
-                super().move()  # Si no hay camino, moverse normalmente
-                return
+                log.debug("Coche %s no encontró un camino válido hacia estacionamientos.", self.unique_id)
+                self.trace(simlog.NO_ROUTE, self.pos)
+                return super().propose_move(ignore_cars)  # Si no hay camino, moverse normalmente
         elif not parking_spots and not self.path_to_parking:
             # Si no hay estacionamientos cerca, moverse normalmente
-            super().move()
-            return
+            return super().propose_move(ignore_cars)
 
         # Movimiento por el camino asignado
         if self.path_to_parking:
             next_pos = self.path_to_parking[0]
-            
-            # Standard movement checks
-            cell_contents = self.model.grid.get_cell_list_contents([next_pos])
-            is_obstructed = any(
-                isinstance(agent, (TrafficLightAgent, SidewalkAgent))
-                and (
-                    (isinstance(agent, TrafficLightAgent) and agent.state == "red") or
-                    (isinstance(agent, SidewalkAgent) and agent.state() == "red")
-                )
-                for agent in cell_contents
-            ) or any(
-                isinstance(agent, (NormalCarAgent, FastCarAgent, SlowCarAgent, 
-                                 DisobedientCarAgent))
-                for agent in cell_contents
-            )
-            
-            if not is_obstructed:
-                self.tiempo_espera = 0
-                self.estado = "tranquilo"
-                next_pos = self.path_to_parking.pop(0)
-                
-                # Check for parking at destination
-                for agent in cell_contents:
-                    if isinstance(agent, ParkingAgent) and not agent.occupied:
-                        self.park(agent)
-                        self.path_to_parking = None
-                        return
-                
-                # Move to next position
-                self.model.grid.move_agent(self, next_pos)
-                self.pos = next_pos
-                print(f"Coche Dijkstra {self.unique_id} se movió a {next_pos}")
-            else:
-                self.tiempo_espera += 1
-                if self.tiempo_espera > 3:
-                    self.estado = "enojado"
-                print(f"Coche Dijkstra {self.unique_id} bloqueado en {self.pos}")
+
+            # Standard movement checks: semáforo o banqueta en rojo, u otro coche
+            if self.model.occupancy.flags_at(next_pos) & blocking_flags(ignore_cars, BLOCKED):
+                return WAIT, next_pos
+            return MOVE, next_pos
+        return super().propose_move(ignore_cars)
+
+    def commit_move(self, action, next_pos):
+        if not self.path_to_parking:
+            super().commit_move(action, next_pos)
+            return
+
+        # Movimiento por el camino asignado
+        if action == MOVE:
+            self.tiempo_espera = 0
+            self.estado = "tranquilo"
+            next_pos = self.path_to_parking.pop(0)
+
+            # Check for parking at destination
+            if self.model.occupancy.is_free_parking(next_pos):
+                self.park(self.model.parkings_by_pos[next_pos])
+                self.path_to_parking = None
+                return
+
+            # Move to next position
+            self.move_to(next_pos)
+            log.debug("Coche Dijkstra %s se movió a %s", self.unique_id, next_pos)
         else:
-            super().move()
+            self.wait_turn()
+            log.debug("Coche Dijkstra %s bloqueado en %s", self.unique_id, self.pos)
+            self.trace(simlog.BLOCKED, next_pos)
 
 
     def step(self):
@@ -335,7 +449,7 @@ class DijkstraCarAgent(NormalCarAgent):
             self.change_lane()
         # Continuar con su movimiento normal
         self.move()
-            
+
 class FastCarAgent(DijkstraCarAgent):  # Cambiado a heredar de DijkstraCarAgent
     def __init__(self, unique_id, model, start_pos):
         super().__init__(unique_id, model, start_pos)
@@ -346,11 +460,16 @@ class FastCarAgent(DijkstraCarAgent):  # Cambiado a heredar de DijkstraCarAgent
     def move(self):
         if self.tiempo_espera > 2:  # Se enoja más rápido
             self.estado = "enojado"
-        
+
         for _ in range(self.speed):  # Se mueve dos veces en cada paso
             if not self.parked:
                 super().move()
 
+    def prepare_step(self):
+        if self.tiempo_espera > 2:  # Se enoja más rápido
+            self.estado = "enojado"
+        self.move_rounds = self.speed
+
 
 class SlowCarAgent(DijkstraCarAgent):  # Cambiado a heredar de DijkstraCarAgent
     def __init__(self, unique_id, model, start_pos):
@@ -369,11 +488,25 @@ class SlowCarAgent(DijkstraCarAgent):  # Cambiado a heredar de DijkstraCarAgent
         # Cambiar de carril si está enojado
         if self.estado == "enojado":
             self.change_lane()
-        
+
         # Cambiar de carril si está enojado
         if self.estado == "enojado":
             self.change_lane()
 
+    def prepare_step(self):
+        self.step_counter += 1
+        self.move_rounds = 0
+        if self.step_counter >= 2:  # Se mueve cada dos pasos
+            self.move_rounds = 1
+            self.step_counter = 0
+
+    def finish_step(self):
+        # Como en step(): reiniciar después de moverse, aunque adjust_behavior lo haya cambiado
+        if self.move_rounds:
+            self.step_counter = 0
+        if self.tiempo_espera > 5:  # Más tolerante
+            self.estado = "enojado"
+
 
 
 class DisobedientCarAgent(DijkstraCarAgent):
@@ -381,48 +514,45 @@ class DisobedientCarAgent(DijkstraCarAgent):
         super().__init__(unique_id, model, start_pos)
         self.estado = "enojado"  # Siempre enojado
 
-    def move(self):
+    def propose_move(self, ignore_cars=False):
         if self.parked:
-            return
-
-        direction = self.model.street_directions.get(self.pos)
-        next_pos = None
+            return None
 
-        if direction == "right":
-            next_pos = (self.pos[0] + 1, self.pos[1])
-        elif direction == "left":
-            next_pos = (self.pos[0] - 1, self.pos[1])
-        elif direction == "up":
-            next_pos = (self.pos[0], self.pos[1] + 1)
-        elif direction == "down":
-            next_pos = (self.pos[0], self.pos[1] - 1)
+        # Solo avanza en celdas con una única dirección
+        move = self.model.street_directions.single_move(self.pos)
+        next_pos = (self.pos[0] + move[0], self.pos[1] + move[1]) if move else None
 
         if next_pos and next_pos in self.model.street_directions:
-            cell_contents = self.model.grid.get_cell_list_contents([next_pos])
+            flags = self.model.occupancy.flags_at(next_pos)
             can_move = True
 
-            for agent in cell_contents:
-                # Ignorar semáforo con probabilidad
-                if isinstance(agent, TrafficLightAgent) and agent.state == "red":
-                    if random.random() > 0.5:  # 50% de ignorar semáforo
-                        print(f"Coche desobediente {self.unique_id} ignora el semáforo en {next_pos}")
-                        continue
-                    else:
-                        can_move = False
-                        break
-
-                # Restricción para no pasar encima de otros coches
-                if isinstance(agent, NormalCarAgent) or isinstance(agent, DijkstraCarAgent) or isinstance(agent, FastCarAgent) or isinstance(agent, SlowCarAgent):
-                    print(f"Coche desobediente {self.unique_id} bloqueado por otro coche en {next_pos}")
+            # Ignorar semáforo con probabilidad
+            if flags & RED_LIGHT:
+                if self.random.random() > 0.5:  # 50% de ignorar semáforo
+                    log.debug("Coche desobediente %s ignora el semáforo en %s", self.unique_id, next_pos)
+                    self.trace(simlog.IGNORE_LIGHT, next_pos)
+                else:
                     can_move = False
-                    break
 
-            if can_move:
-                self.model.grid.move_agent(self, next_pos)
-                self.pos = next_pos
-                print(f"Coche desobediente {self.unique_id} se movió a {next_pos}")
-            else:
-                print(f"Coche desobediente {self.unique_id} no pudo moverse a {next_pos}")
+            # Restricción para no pasar encima de otros coches
+            if can_move and flags & CAR and not ignore_cars:
+                log.debug("Coche desobediente %s bloqueado por otro coche en %s", self.unique_id, next_pos)
+                can_move = False
+
+            return (MOVE if can_move else WAIT), next_pos
+        return None
+
+    def commit_move(self, action, next_pos):
+        if action == MOVE:
+            self.move_to(next_pos)
+            log.debug("Coche desobediente %s se movió a %s", self.unique_id, next_pos)
+        else:
+            log.debug("Coche desobediente %s no pudo moverse a %s", self.unique_id, next_pos)
+            self.trace(simlog.BLOCKED, next_pos)
+
+    def wants_lane_change(self):
+        # Siempre cambia de carril porque está enojado
+        return True
 
     def step(self):
         # Siempre cambiar de carril porque está enojado
@@ -436,26 +566,47 @@ class ParkingAgent(mesa.Agent):
     def __init__(self, unique_id, model, number):
         super().__init__(unique_id, model)
         self.number = number
-        self.occupied = False
+        self._occupied = False
+
+    @property
+    def occupied(self):
+        return self._occupied
+
+    @occupied.setter
+    def occupied(self, value):
+        # Avisar al modelo para la capa de ocupación y las rutas que apuntan aquí
+        self._occupied = value
+        self.model.parking_changed(self)
 
 class TrafficLightAgent(mesa.Agent):
     def __init__(self, unique_id, model):
         super().__init__(unique_id, model)
         self.state = "red"
         self.timer = 0
+        # Celdas que ocupa el semáforo y banquetas ligadas (las llena el modelo)
+        self.cells = []
+        self.sidewalks = []
 
     def toggle_state(self):
         if self.state == "red":
             self.state = "green"
         else:
             self.state = "red"
+        self.model.occupancy.light_changed(self)
 
     def step(self):
         self.timer += 1
-        if self.timer >= 10:
+        if self.timer >= self.model.light_interval:
             self.toggle_state()
             self.timer = 0
 
+    def prepare_step(self):
+        # En el modo por etapas los semáforos cambian antes de que los coches decidan
+        self.step()
+
+    def finish_step(self):
+        pass
+
 class SidewalkAgent(mesa.Agent):
     def __init__(self, unique_id, model, linked_traffic_light):
         super().__init__(unique_id, model)
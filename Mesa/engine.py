@@ -0,0 +1,343 @@
+# engine.py
+"""Motor vectorizado para el movimiento de los coches.
+
+Con TrafficModel(engine="vector") los coches dejan de ser agentes del schedule:
+posición, estado, tiempo de espera y velocidad viven en arreglos NumPy y cada
+tick calcula para todos a la vez los movimientos propuestos, los bloqueos por
+semáforos, banquetas y otros coches, y los conflictos entre coches que quieren
+la misma celda. Los semáforos siguen siendo agentes.
+
+Reglas de agents.py, aplicadas por fases:
+- Un coche enojado que no pudo avanzar intenta cambiar de carril, una vez
+  por tick, pero no a una celda por la que espera entrar un coche que lleva
+  más tiempo esperando.
+- NormalCarAgent sigue la dirección de su celda; en celdas con varias
+  direcciones elige una al azar.
+- Dijkstra, Fast y Slow siguen el camino más corto a un estacionamiento libre
+  si está a detection_radius pasos o menos; si no, se mueven como los normales.
+- FastCarAgent avanza speed celdas por tick y se enoja con más de 2 de espera;
+  SlowCarAgent avanza cada dos ticks y se enoja con más de 5.
+- Con menos de 5 estacionamientos libres, como en adjust_behavior,
+  FastCarAgent pasa a speed 3 y DijkstraCarAgent a un radio de 2, y así se
+  quedan. La cadencia de SlowCarAgent no cambia: step() reinicia su contador
+  después de moverse.
+- DisobedientCarAgent ignora el semáforo en rojo con probabilidad 0.5 y nunca
+  se estaciona.
+
+Como en el modo por etapas de TrafficModel, si varios coches quieren la misma
+celda gana el que lleva más tiempo esperando y, en empate, el de menor
+unique_id; el ganador entra a una celda ocupada solo si el coche que está ahí
+también avanza en la misma fase, así que una fila de coches se mueve completa.
+"""
+import numpy as np
+
+from agents import DijkstraCarAgent, DisobedientCarAgent, FastCarAgent, NormalCarAgent, SlowCarAgent
+from occupancy import BLOCKED, CAR, FREE_PARKING, OBSTACLE, RED_LIGHT
+from roadgrid import DIRECTION_OFFSETS
+import simlog
+
+# Tipo de cada coche en los arreglos
+NORMAL, DIJKSTRA, FAST, SLOW, DISOBEDIENT = range(5)
+CAR_KINDS = {
+    NormalCarAgent: NORMAL,
+    DijkstraCarAgent: DIJKSTRA,
+    FastCarAgent: FAST,
+    SlowCarAgent: SLOW,
+    DisobedientCarAgent: DISOBEDIENT,
+}
+
+UNREACHABLE = 1 << 20
+
+# Orden en que se revisan los estacionamientos vecinos: por (x, y), como el
+# desempate de StreetGraph.find_shortest_path
+PARKING_NEIGHBOR_ORDER = [
+    list(DIRECTION_OFFSETS.values()).index(offset) for offset in sorted(DIRECTION_OFFSETS.values())
+]
+
+
+class VectorEngine:
+    """Estado de todos los coches en arreglos y un step() que los avanza juntos.
+
+    Las celdas se identifican como en RoadGrid y Occupancy: x * height + y.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.height = model.grid.height
+        self.agents = [agent for agent in model.schedule.agents if isinstance(agent, NormalCarAgent)]
+        unknown = {type(agent).__name__ for agent in self.agents if type(agent) not in CAR_KINDS}
+        if unknown:
+            raise ValueError(f"El motor vectorial no soporta: {', '.join(sorted(unknown))}")
+
+        self.ids = np.array([agent.unique_id for agent in self.agents], dtype=np.int32)
+        self.kind = np.array([CAR_KINDS[type(agent)] for agent in self.agents], dtype=np.int8)
+        self.cell = np.array([x * self.height + y for x, y in (agent.pos for agent in self.agents)], dtype=np.intp)
+        self.parked = np.array([agent.parked for agent in self.agents], dtype=bool)
+        self.angry = np.array([agent.estado == "enojado" for agent in self.agents], dtype=bool)
+        self.wait = np.array([agent.tiempo_espera for agent in self.agents], dtype=np.int32)
+        self.step_counter = np.array([getattr(agent, "step_counter", 0) for agent in self.agents], dtype=np.int32)
+        self.speed = np.array([getattr(agent, "speed", 1) for agent in self.agents], dtype=np.int32)
+        self.radius = np.array(
+            [getattr(agent, "detection_radius", model.detection_radius) for agent in self.agents], dtype=np.int32
+        )
+        self.routing = np.isin(self.kind, (DIJKSTRA, FAST, SLOW))
+
+        # Los coches ya no se avanzan ni se guardan como agentes
+        for agent in self.agents:
+            model.schedule.remove(agent)
+            model.grid.remove_agent(agent)
+
+        # Radio de detección de DijkstraCarAgent medido en pasos por la calle; con
+        # pocos estacionamientos libres adjust_behavior lo cambia a 2
+        self.route_radius = max(model.detection_radius, 2)
+        self.rng = np.random.default_rng(model.random.getrandbits(64))
+        self.flags = model.occupancy.flags.ravel()
+        self.build_road_tables()
+
+    def build_road_tables(self):
+        """Tablas por celda que dependen solo del mapa de calles"""
+        road = self.model.street_directions
+        width, height = road.width, road.height
+        size = width * height
+        cells = np.arange(size)
+        xs, ys = np.divmod(cells, height)
+
+        # Vecino de cada celda en cada dirección de DIRECTION_OFFSETS (-1 fuera del mapa)
+        neighbors = np.full((len(DIRECTION_OFFSETS), size), -1, dtype=np.intp)
+        for d, (dx, dy) in enumerate(DIRECTION_OFFSETS.values()):
+            inside = (0 <= xs + dx) & (xs + dx < width) & (0 <= ys + dy) & (ys + dy < height)
+            neighbors[d, inside] = (xs[inside] + dx) * height + ys[inside] + dy
+
+        codes = road.codes.ravel().astype(np.intp)
+        counts, directions = road.move_table()
+        multi = np.array([road.is_multi_code(code) for code in range(len(counts))], dtype=bool)
+        code_masks = np.array([road.code_mask(code) for code in range(len(counts))], dtype=np.uint8)
+
+        self.is_street = codes != 0
+        self.move_counts = counts[codes]
+        # Celda a la que lleva cada dirección permitida, en el orden en que se asignaron
+        cell_directions = directions[codes].T
+        self.next_cells = np.where(cell_directions >= 0, neighbors[cell_directions.clip(0), cells], -1)
+        # DisobedientCarAgent solo avanza en celdas con una única dirección
+        self.single_next = np.where(self.is_street & ~multi[codes], self.next_cells[0], -1)
+
+        # Carriles a los que se puede cambiar (change_lane), sin contar coches
+        masks = code_masks[codes]
+        lane_masks = np.where(multi[codes], masks, 0)
+        adjacent_codes = np.where(neighbors >= 0, codes[neighbors], 0)
+        lane_ok = (adjacent_codes != 0) & (
+            ((lane_masks != 0) & ~multi[adjacent_codes] & ((code_masks[adjacent_codes] & lane_masks) != 0))
+            | (adjacent_codes == codes)
+        )
+        self.lane_targets = np.where(lane_ok, neighbors, -1)
+
+        # Estacionamientos vecinos de cada celda de calle
+        is_parking = np.zeros(size, dtype=bool)
+        for x, y in self.model.parkings_by_pos:
+            is_parking[x * height + y] = True
+        parking_neighbors = neighbors[PARKING_NEIGHBOR_ORDER]
+        self.parking_neighbors = np.where(
+            self.is_street & (parking_neighbors >= 0) & is_parking[parking_neighbors], parking_neighbors, -1
+        )
+        # Solo las celdas a route_radius pasos o menos de algún estacionamiento
+        # pueden tener ruta; el campo de distancias se calcula únicamente para ellas
+        self.field_cells = cells
+        _, dist = self.parking_distance(np.ones(size, dtype=bool))
+        self.field_cells = np.flatnonzero(dist <= self.route_radius)
+        self._field_version = None
+
+    def parking_distance(self, free):
+        """(estacionamiento al que entra cada celda, pasos hasta el libre más cercano)
+        para las celdas de field_cells, considerando libres los marcados en free"""
+        size = len(free)
+        cells = self.field_cells
+        neighbors = self.parking_neighbors[:, cells]
+        target = np.full(size, -1, dtype=np.intp)
+        # Recorrer al revés para que gane el primer vecino en PARKING_NEIGHBOR_ORDER
+        for candidates in neighbors[::-1]:
+            hit = (candidates >= 0) & free[candidates]
+            target[cells[hit]] = candidates[hit]
+
+        # Mismas aristas que StreetGraph: solo las celdas con una única dirección
+        # llevan a la siguiente, así que las rutas no cruzan intersecciones ni la glorieta
+        dist = np.full(size, UNREACHABLE, dtype=np.int32)
+        dist[target >= 0] = 1
+        single_next = self.single_next[cells]
+        has_next = single_next >= 0
+        for _ in range(self.route_radius - 1):
+            through = np.where(has_next, dist[single_next] + 1, UNREACHABLE)
+            dist[cells] = np.minimum(dist[cells], through)
+        return target, dist
+
+    def build_parking_field(self):
+        """Distancia en pasos al estacionamiento libre más cercano (hasta route_radius)
+        y el estacionamiento al que entra cada celda que está junto a uno"""
+        self.park_target, self.parking_dist = self.parking_distance((self.flags & FREE_PARKING) != 0)
+        self._field_version = self.model.parking_changes
+
+    def step(self):
+        # adjust_behavior: los cambios se quedan aunque se vuelvan a liberar estacionamientos
+        if self.model.free_parking_count() < 5:
+            self.speed[self.kind == FAST] = 3
+            self.radius[self.kind == DIJKSTRA] = 2
+
+        active = ~self.parked
+        # FastCarAgent se enoja más rápido
+        self.angry |= active & (self.kind == FAST) & (self.wait > 2)
+        # SlowCarAgent avanza cada dos ticks
+        slow = active & (self.kind == SLOW)
+        self.step_counter[slow] += 1
+        slow_moves = slow & (self.step_counter >= 2)
+        self.step_counter[slow_moves] = 0
+        active &= ~slow | slow_moves
+
+        changed_lane = np.zeros(len(self.ids), dtype=bool)
+        for substep in range(int(self.speed.max(initial=0))):
+            movers = np.flatnonzero(active & ~self.parked & (self.speed > substep))
+            if not len(movers):
+                break
+            stalled = movers[~self.move(movers)]
+            stalled = stalled[self.angry[stalled] & ~changed_lane[stalled]]
+            changed_lane[self.change_lanes(stalled)] = True
+
+        # SlowCarAgent es más tolerante
+        self.angry |= ~self.parked & (self.kind == SLOW) & (self.wait > 5)
+
+    def resolve(self, cars, targets):
+        """Máscara de los coches que se quedan con su celda destino (mismo criterio
+        que TrafficModel.resolve_targets)"""
+        order = np.lexsort((self.ids[cars], -self.wait[cars], targets))
+        ordered = targets[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = ordered[1:] != ordered[:-1]
+        winners = np.zeros(len(targets), dtype=bool)
+        winners[order[first]] = True
+        return winners
+
+    def relocate(self, cars, targets, event):
+        self.model.occupancy.move_cars(self.cell[cars], targets)
+        self.cell[cars] = targets
+        self.trace(cars, event)
+
+    def longest_wait_into(self):
+        """Mayor tiempo de espera, por celda, entre los coches cuya calle lleva a ella
+        (-1 si ninguno); como TrafficModel.longest_wait_into"""
+        longest = np.full(len(self.flags), -1, dtype=np.int32)
+        cars = np.flatnonzero(~self.parked)
+        for next_cells in self.next_cells[:, self.cell[cars]]:
+            leads = next_cells >= 0
+            np.maximum.at(longest, next_cells[leads], self.wait[cars[leads]])
+        return longest
+
+    def change_lanes(self, cars):
+        """Cambia de carril a los coches indicados que puedan; devuelve los que cambiaron"""
+        if not len(cars):
+            return cars
+        candidates = self.lane_targets[:, self.cell[cars]]
+        free = (candidates >= 0) & ((self.flags[candidates] & CAR) == 0)
+        can_change = free.any(axis=0)
+        cars = cars[can_change]
+        targets = candidates[free[:, can_change].argmax(axis=0), can_change]
+        yields = self.longest_wait_into()[targets] > self.wait[cars]
+        cars, targets = cars[~yields], targets[~yields]
+        winners = self.resolve(cars, targets)
+        self.relocate(cars[winners], targets[winners], simlog.LANE_CHANGE)
+        return cars[winners]
+
+    def follow_chains(self, cells, targets):
+        """Máscara de los coches (ya ganadores de su celda destino) que pueden avanzar:
+        la celda destino está libre o el coche que la ocupa también avanza. Se
+        sigue cada fila duplicando el salto (pointer jumping); en un ciclo nadie
+        llega a una celda libre y nadie avanza."""
+        ok = (self.flags[targets] & CAR) == 0
+        leaver = np.full(len(self.flags), -1, dtype=np.intp)
+        leaver[cells] = np.arange(len(cells))
+        ahead = np.where(ok, -1, leaver[targets])
+        for _ in range(len(cells).bit_length() + 1):
+            has = ahead >= 0
+            if not has.any():
+                break
+            ok[has] |= ok[ahead[has]]
+            ahead[has] = ahead[ahead[has]]
+        return ok
+
+    def move(self, cars):
+        """Avanza una celda a los coches indicados; devuelve la máscara de los que se movieron"""
+        if self._field_version != self.model.parking_changes:
+            self.build_parking_field()
+        cells = self.cell[cars]
+        kinds = self.kind[cars]
+        count = len(cars)
+
+        # Dirección al azar entre las permitidas
+        choice = (self.rng.random(count) * self.move_counts[cells]).astype(np.intp)
+        targets = self.next_cells[choice, cells]
+
+        # Ruta al estacionamiento libre más cercano
+        routed = self.routing[cars] & (self.parking_dist[cells] <= self.radius[cars])
+        to_park = np.zeros(count, dtype=bool)
+        if routed.any():
+            routed_cells = cells[routed]
+            # La distancia solo baja por single_next (ver parking_distance)
+            best = self.single_next[routed_cells]
+            arrived = self.parking_dist[routed_cells] == 1
+            targets[routed] = np.where(arrived, self.park_target[routed_cells], best)
+            to_park[routed] = arrived
+
+        disobedient = kinds == DISOBEDIENT
+        targets[disobedient] = self.single_next[cells[disobedient]]
+
+        valid = (targets >= 0) & (self.is_street[targets] | to_park)
+        flags = np.where(valid, self.flags[targets], 0)
+        # Las celdas de estacionamiento están dentro de edificios; los coches se
+        # revisan después, con follow_chains
+        blocked = (flags & np.where(to_park | routed, BLOCKED, BLOCKED | OBSTACLE) & ~CAR) != 0
+        red = disobedient & ((flags & RED_LIGHT) != 0)
+        ignores_light = red & (self.rng.random(count) > 0.5)
+        blocked[disobedient] = (red & ~ignores_light)[disobedient]
+        if self.model.trace is not None and ignores_light.any():
+            self.trace(cars[ignores_light], simlog.IGNORE_LIGHT, targets[ignores_light])
+
+        candidates = valid & ~blocked
+        winners = np.zeros(count, dtype=bool)
+        winners[candidates] = self.resolve(cars[candidates], targets[candidates])
+        winners[winners] = self.follow_chains(cells[winners], targets[winners])
+
+        parking = winners & to_park
+        moving = winners & ~to_park
+        self.relocate(cars[moving], targets[moving], simlog.MOVE)
+        self.relocate(cars[parking], targets[parking], simlog.PARK)
+        self.wait[cars[winners]] = 0
+        self.angry[cars[winners]] = disobedient[winners]
+        if parking.any():
+            self.parked[cars[parking]] = True
+            parkings = self.model.parkings_by_pos
+            for cell in targets[parking].tolist():
+                parkings[divmod(cell, self.height)].occupied = True
+
+        # Bloqueados o sin una celda válida enfrente; DisobedientCarAgent no cuenta la espera
+        waiting = ~winners & ~disobedient & ((self.move_counts[cells] > 0) | routed)
+        waiting_cars = cars[waiting]
+        self.wait[waiting_cars] += 1
+        self.angry[waiting_cars] |= self.wait[waiting_cars] > 3
+        self.trace(cars[waiting & valid], simlog.BLOCKED, targets[waiting & valid])
+        return winners
+
+    def trace(self, cars, event, cells=None):
+        trace = self.model.trace
+        if trace is None or not len(cars):
+            return
+        xs, ys = np.divmod(self.cell[cars] if cells is None else cells, self.height)
+        trace.record_many(self.model.schedule.steps, self.ids[cars], event, xs, ys)
+
+    def sync_agents(self):
+        """Copia el estado de los arreglos a los objetos de agente y los devuelve"""
+        positions = zip(*(values.tolist() for values in np.divmod(self.cell, self.height)))
+        for agent, pos, parked, angry, wait in zip(
+            self.agents, positions, self.parked.tolist(), self.angry.tolist(), self.wait.tolist()
+        ):
+            agent.pos = pos
+            agent.parked = parked
+            agent.estado = "enojado" if angry else "tranquilo"
+            agent.tiempo_espera = wait
+        return self.agents
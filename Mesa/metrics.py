@@ -0,0 +1,138 @@
+# metrics.py
+"""Métricas por tick de TrafficModel en columnas NumPy.
+
+En lugar del DataCollector de Mesa (un dict por agente y por paso), cada tick
+agrega una fila de agregados a arreglos preasignados: coches en movimiento,
+bloqueados, estacionados y enojados, espera promedio, estacionamientos libres
+y cuántos coches entraron a cada tramo de calle (las calles del escenario).
+
+Se activa con TrafficModel(collect_metrics=True); la fila 0 es el estado
+inicial. Se exporta a .npz o, si pyarrow está instalado, a Parquet.
+"""
+import numpy as np
+
+# Columna -> dtype de los agregados por tick
+COLUMNS = {
+    "step": np.int32,
+    "moving": np.int32,
+    "blocked": np.int32,
+    "parked": np.int32,
+    "angry": np.int32,
+    "avg_wait": np.float32,
+    "free_parkings": np.int32,
+}
+
+
+def import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise ImportError("Exportar a Parquet requiere pyarrow; usa un archivo .npz") from error
+    return pa, pq
+
+
+def check_export(path):
+    """Falla antes de simular si save(path) no va a poder exportar"""
+    if str(path).endswith(".parquet"):
+        import_pyarrow()
+
+
+class MetricsCollector:
+    """Agregados por tick guardados en columnas que crecen al doble al llenarse"""
+
+    def __init__(self, model, capacity=1024):
+        self.model = model
+        self.length = 0
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+        # Tramo de calle de cada celda (x * height + y), -1 fuera de las calles
+        width, height = model.grid.width, model.grid.height
+        self.segments = model.scenario.streets
+        segment_of = np.full((width, height), -1, dtype=np.int32)
+        for index, (x0, x1, y0, y1, _) in enumerate(self.segments):
+            segment_of[max(x0, 0):x1, max(y0, 0):y1] = index
+        self.segment_of = segment_of.ravel()
+        self.throughput = np.zeros((capacity, len(self.segments)), dtype=np.int32)
+        self._car_segments = None
+
+    def __len__(self):
+        return self.length
+
+    def car_state(self):
+        """(celda, estacionado, enojado, tiempo de espera) de cada coche, en orden de unique_id"""
+        engine = self.model.engine
+        if engine is not None:
+            # En modo vectorial el estado ya está en arreglos (ordenados por unique_id)
+            return engine.cell, engine.parked, engine.angry, engine.wait
+        cars = sorted(self.model.car_agents(), key=lambda car: car.unique_id)
+        height = self.model.grid.height
+        count = len(cars)
+        cells = np.fromiter((car.pos[0] * height + car.pos[1] for car in cars), dtype=np.intp, count=count)
+        parked = np.fromiter((car.parked for car in cars), dtype=bool, count=count)
+        angry = np.fromiter((car.estado == "enojado" for car in cars), dtype=bool, count=count)
+        wait = np.fromiter((car.tiempo_espera for car in cars), dtype=np.int32, count=count)
+        return cells, parked, angry, wait
+
+    def grow(self):
+        capacity = 2 * len(self.columns["step"])
+        for name, column in self.columns.items():
+            self.columns[name] = np.resize(column, capacity)
+        self.throughput = np.resize(self.throughput, (capacity, self.throughput.shape[1]))
+
+    def collect(self):
+        """Agrega la fila del tick actual"""
+        if self.length == len(self.columns["step"]):
+            self.grow()
+        cells, parked, angry, wait = self.car_state()
+        active = ~parked
+        waits = wait[active]
+
+        row = self.length
+        columns = self.columns
+        columns["step"][row] = self.model.schedule.steps
+        columns["blocked"][row] = np.count_nonzero(waits > 0)
+        columns["moving"][row] = len(waits) - columns["blocked"][row]
+        columns["parked"][row] = np.count_nonzero(parked)
+        columns["angry"][row] = np.count_nonzero(angry)
+        columns["avg_wait"][row] = waits.mean() if len(waits) else 0.0
+        columns["free_parkings"][row] = self.model.free_parking_count()
+
+        # Entradas a cada tramo: coches cuyo tramo cambió desde el tick anterior
+        car_segments = self.segment_of[cells]
+        if self._car_segments is not None and len(self.segments):
+            entered = car_segments[(car_segments != self._car_segments) & (car_segments >= 0)]
+            self.throughput[row] = np.bincount(entered, minlength=len(self.segments))
+        else:
+            self.throughput[row] = 0
+        self._car_segments = car_segments
+        self.length += 1
+
+    def to_arrays(self):
+        """Columnas recortadas a los ticks registrados (vistas, sin copiar)"""
+        arrays = {name: column[:self.length] for name, column in self.columns.items()}
+        arrays["throughput"] = self.throughput[:self.length]
+        return arrays
+
+    def save_npz(self, path):
+        segments = np.array([street[:4] for street in self.segments], dtype=np.int32).reshape(-1, 4)
+        directions = np.array([str(street[4]) for street in self.segments])
+        # Con un archivo abierto savez_compressed no agrega ".npz" al nombre
+        with open(path, "wb") as metrics_file:
+            np.savez_compressed(metrics_file, segments=segments, segment_directions=directions, **self.to_arrays())
+
+    def save_parquet(self, path):
+        """Una fila por tick; el flujo de cada tramo va en las columnas segment_<i>"""
+        pa, pq = import_pyarrow()
+        arrays = self.to_arrays()
+        throughput = arrays.pop("throughput")
+        for index in range(throughput.shape[1]):
+            arrays[f"segment_{index}"] = throughput[:, index]
+        pq.write_table(pa.table(arrays), path)
+
+    def save(self, path):
+        """Exporta según la extensión: .parquet o .npz"""
+        if str(path).endswith(".parquet"):
+            self.save_parquet(path)
+        else:
+            self.save_npz(path)
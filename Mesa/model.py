@@ -1,406 +1,435 @@
+import os
+
 import mesa
 from mesa.visualization.modules import CanvasGrid
 from mesa.visualization.ModularVisualization import ModularServer
 from agents import (NormalCarAgent, FastCarAgent, SlowCarAgent, DisobedientCarAgent, 
                     DijkstraCarAgent, ParkingAgent, TrafficLightAgent, SidewalkAgent,
-                   BuildingAgent, RoundaboutAgent, StreetAgent)
+                   BuildingAgent, RoundaboutAgent, StreetAgent, StreetGraph, MOVE, PARK, WAIT)
+from engine import VectorEngine
+from metrics import MetricsCollector
+from occupancy import Occupancy
+from profiling import NullProfiler, StepProfiler
+from roadgrid import RoadGrid
+from routing import RoutingTable
+from scenario import CAR_TYPES, default_scenario
+from simlog import EventTrace
+
+# Etapas de StagedActivation en el modo "staged"; las de "model." las ejecuta el modelo
+STAGES = ["prepare_step", "model.stage_moves", "finish_step"]
+
 
 class TrafficModel(mesa.Model):
-    def __init__(self, width=24, height=24):
+    def __init__(self, width=None, height=None, precompute_routes=False, routes_file=None, seed=None,
+                 trace=False, scenario=None, engine="agents", step_mode="sequential",
+                 light_interval=10, detection_radius=3, collect_metrics=False, profile=False):
+        # mesa.Model.__new__ toma "seed" de los kwargs para inicializar self.random
         super().__init__()
+        # Mapa y flota; width/height solo cambian el tamaño del grid
+        self.scenario = scenario if scenario is not None else default_scenario()
+        width = self.scenario.width if width is None else width
+        height = self.scenario.height if height is None else height
         self.grid = mesa.space.MultiGrid(width, height, False)
-        self.schedule = mesa.time.RandomActivation(self)
-        self.street_directions = {}
-
-        # Calle larga de abajo, dirección a la derecha
-        # carril 1
-        for x in range(0, 23):  # De 0 a 22
-            self.street_directions[(x, 0)] = "right"
-        # carril 2
-        for x in range(1, 22):
-            self.street_directions[(x, 1)] = "right"
-
-        # Calle larga de la izquierda, dirección hacia abajo
-        # carril 1
-        for y in range(1, 24):
-            self.street_directions[(0, y)] = "down"
-        # carril 2
-        for y in range(2, 23):
-            self.street_directions[(1, y)] = "down"
-
-        # Calle larga de la derecha, dirección hacia arriba
-        # carril 1
-        for y in range(0, 24):
-            self.street_directions[(23, y)] = "up"
-        # carril 2
-        for y in range(1, 22):
-            self.street_directions[(22, y)] = "up"
-
-        # Calle larga de arriba, dirección a la izquierda
-        # carril 1
-        for x in range(1, 24):
-            self.street_directions[(x, 23)] = "left"
-        # carril 2
-        for x in range(2, 23):
-            self.street_directions[(x, 22)] = "left"
-
-        # Calle pequeña entre parking 3 y 5, dirección hacia la izquierda
-        # carril 1
-        for x in range(2, 6):
-            self.street_directions[(x, 4)] = "left"
-        # carril 2
-        for x in range(2, 6):
-            self.street_directions[(x, 5)] = "left"
-
-        # Calle pequeña entre parking 11 y 8, dirección hacia la derecha
-        # carril 1
-        for x in range(8, 12):
-            self.street_directions[(x, 4)] = "right"
-        # carril 2
-        for x in range(8, 12):
-            self.street_directions[(x, 5)] = "right"
-
-        # Calle pequeña entre parking 9 y 7, dirección hacia la izquierda
-        # carril 1
-        for x in range(8, 12):
-            self.street_directions[(x, 17)] = "left"
-        # carril 2
-        for x in range(8, 12):
-            self.street_directions[(x, 18)] = "left"
-
-        # Calle pequeña del edificio inferior izquierdo, dirección hacia abajo
-        # carril 1
-        for y in range(2, 8):
-            self.street_directions[(6, y)] = "down"
-        # carril 2
-        for y in range(2, 8):
-            self.street_directions[(7, y)] = "down"
-
-        # Calle pequeña del edificio superior izquierdo, dirección hacia arriba
-        # carril 1
-        for y in range(12, 22):
-            self.street_directions[(6, y)] = "up"
-        # carril 2
-        for y in range(12, 22):
-            self.street_directions[(7, y)] = "up"
-
-        # Calle pequeña entre parking 15 y 16, dirección hacia la izquierda
-        # carril 1
-        for x in range(16, 22):
-            self.street_directions[(x, 17)] = "left"
-        # carril 2
-        for x in range(16, 22):
-            self.street_directions[(x, 16)] = "left"
-
-        
-        # Calle pequeña entre parking 14 y 17, dirección hacia arriba
-        # carril 1
-        for y in range(2,8):
-            self.street_directions[(18, y)] = "up"
-        # carril 2
-        for y in range(2,8):
-            self.street_directions[(19, y)] = "up"
-
-        # Calle central lado izquierdo de la glorieta, dirección hacia la derecha
-        # carril 1
-        for x in range(2, 12):
-            self.street_directions[(x, 8)] = "right"
-        # carril 2
-        for x in range(2, 12):
-            self.street_directions[(x, 9)] = "right"
-
-        # Calle central lado izquierdo de la glorieta, dirección hacia la izquierda
-        # carril 1
-        for x in range(2, 12):
-            self.street_directions[(x, 11)] = "left"
-        # carril 2
-        for x in range(2, 12):
-            self.street_directions[(x, 10)] = "left"
-
-        # Calle central lado derecho de la glorieta, dirección hacia la izquierda
-        # carril 1
-        for x in range(16, 22):
-            self.street_directions[(x, 11)] = "left"
-        # carril 2
-        for x in range(16, 22):
-            self.street_directions[(x, 10)] = "left"
-
-        # Calle central lado derecho de la glorieta, dirección hacia la derecha
-        # carril 1
-        for x in range(16, 22):
-            self.street_directions[(x, 8)] = "right"
-        # carril 2
-        for x in range(16, 22):
-            self.street_directions[(x, 9)] = "right"
-
-        # Calle central lado superior de la glorieta, dirección hacia abajo
-        # carril 1
-        for y in range(12, 22):
-            self.street_directions[(12, y)] = "down"
-            self.street_directions[(13, y)] = "down"
-
-        # Calle central lado superior de la glorieta, dirección hacia arriba
-        # carril 1
-        for y in range(12, 22):
-            self.street_directions[(14, y)] = "up"
-            self.street_directions[(15, y)] = "up"
-
-        # Calle central lado inferior de la glorieta, dirección hacia arriba
-        # carril 1
-        for y in range(2, 8):
-            self.street_directions[(15, y)] = "up"
-        # carril 2
-        for y in range(2, 8):
-            self.street_directions[(14, y)] = "up"
-
-        # Calle central lado inferior de la glorieta, dirección hacia abajo
-        # carril 1
-        for y in range(2, 8):
-            self.street_directions[(12, y)] = "down"
-        # carril 2
-        for y in range(2, 8):
-            self.street_directions[(13, y)] = "down"
-
-
-
-
-         # glorieta parte inferior hacia la derecha
-        for x in range (13, 15):
-            self.street_directions[(x, 8)] = "right"
-
-        # glorieta parte superior hacia la izquierda
-        for x in range (13, 15):
-            self.street_directions[(x, 11)] = "left"
-        
-        #glorieta parte izquierda hacia abajo
-        for y in range (9, 12):
-            self.street_directions[(12, y)] = "down"
-            
-        #glorieta parte derecha hacia arriba
-        for y in range (9,12):
-            self.street_directions[(15, y)] = "up"
-
-
-
-        # Puntos con múltiples opciones de dirección
-        self.street_directions[(12, 8)] = ["right", "down"]
-
-
-        self.street_directions[(12, 11)] = ["left", "down"]
-        
-
-        self.street_directions[(15, 8)] = ["up", "right"]
-
-
-        self.street_directions[(15, 11)] = ["up", "left"]
-
-
-        # Puntos con múltiples opciones de dirección
-        # ESTOS SE USAN PARA DIVAGAR POR TODO EL MAPA
-        self.street_directions[(1, 9)] = ["down", "right"]
-        self.street_directions[(1, 8)] = ["down", "right"]
-        self.street_directions[(6, 7)] = ["right", "down"]
-        self.street_directions[(7, 7)] = ["right", "down"]
-        self.street_directions[(6, 5)] = ["left", "down"]
-        self.street_directions[(6, 4)] = ["left", "down"]
-        self.street_directions[(7, 5)] = ["right", "down"]
-        self.street_directions[(7, 4)] = ["right", "down"]
-        self.street_directions[(6, 11)] = ["left", "up"]
-        self.street_directions[(7, 11)] = ["left", "up"]
-        self.street_directions[(12, 17)] = ["left", "down"]
-        self.street_directions[(12, 18)] = ["left", "down"]
-        self.street_directions[(12, 22)] = ["left", "down"]
-        self.street_directions[(13, 22)] = ["left", "down"]
-        self.street_directions[(18, 1)] = ["right", "up"]
-        self.street_directions[(19, 1)] = ["right", "up"]
-        self.street_directions[(22, 16)] = ["left", "up"]
-        self.street_directions[(22, 17)] = ["left", "up"]
-        self.street_directions[(22, 10)] = ["left", "up"]
-        self.street_directions[(22, 11)] = ["left", "up"]
-        self.street_directions[(14, 1)] = ["right", "up"]
-        self.street_directions[(15, 1)] = ["right", "up"]
-        self.street_directions[(6, 8)] = ["right", "down"]
-        self.street_directions[(7, 8)] = ["right", "down"]
-
-        self.street_directions[(23, 17)] = ["left", "up"]
-        self.street_directions[(12, 23)] = ["left", "down"]
-        self.street_directions[(0, 8)] = ["right", "down"]
-        self.street_directions[(15, 1)] = ["right", "up"]
-
-        # Crear edificios (coordenadas precisas)
-        buildings = [
-            (2, 2, 4, 2),
-            (2, 6, 4, 2),
-            (8, 2, 4, 2),
-            (8, 6, 4, 2),
-            (2, 12, 4, 10),
-            (8, 12, 4, 5),
-            (8, 19, 4, 3),
-            (16, 2, 2, 6),
-            (20, 2, 2, 6),
-            (16, 12, 6, 4),
-            (16, 18, 6, 4)
-        ]
-
-        # Crear estacionamientos con sus números específicos
-        parkings = [
-            (3, 21, 2),
-            (5, 17, 6),
-            (2, 14, 1),
-            (4, 12, 4),
-            (4, 3, 5),
-            (3, 6, 3),
-            (9, 2, 8),
-            (10, 7, 11),
-            (8, 15, 7),
-            (10, 19, 9),
-            (10, 12, 10),
-            (17, 6, 13),
-            (17, 4, 14),
-            (20, 4, 17),
-            (20, 15, 16),
-            (20, 18, 15),
-            (17, 21, 12)
-        ]
-
-        # Configuración de semáforos y aceras
-        traffic_light_sidewalks = [
-            (5, 0, 2, 6, 2, 2),    # Semáforo izquierdo y su sidewalk
-            (2, 4, 2, 0, 6, 2),    # Semáforo inferior y su sidewalk
-            (8, 17, 2, 6, 16, 2),  # Semáforo central y su sidewalk
-            (8, 22, 2, 6, 21, 2),  # Semáforo derecho y su sidewalk
-            (17, 8, 2, 18, 7, 2)   # Semáforo derecho y su sidewalk
-        ]
-
-        # Crear glorieta (2x2)
-        roundabout = [(13, 9), (14, 9), (13, 10), (14, 10)]
+        # "sequential": cada coche decide y se mueve en turno, en orden aleatorio.
+        # "staged": todos deciden con el mismo estado, se resuelven los conflictos
+        # y luego se aplican los movimientos (ver stage_moves).
+        if step_mode == "sequential":
+            self.schedule = mesa.time.RandomActivation(self)
+        elif step_mode == "staged":
+            self.schedule = mesa.time.StagedActivation(self, stage_list=STAGES)
+        else:
+            raise ValueError(f"Modo de paso desconocido: {step_mode}")
+        # Mapa de calles: posición -> dirección, guardado como códigos uint8 por celda
+        self.street_directions = RoadGrid(width, height)
+        # Grafo de calles compartido, se construye la primera vez que se necesita
+        self._street_graph = None
+        # Tabla opcional de distancias/siguiente salto entre todas las celdas
+        self.precompute_routes = precompute_routes or routes_file is not None
+        self.routes_file = routes_file
+        self._routing_table = None
+        # Traza binaria de eventos de los agentes (desactivada por defecto)
+        self.trace = EventTrace() if trace else None
+        # Tiempos por fase y por clase de agente (ver profiling.py)
+        self.profiler = StepProfiler() if profile else NullProfiler()
+        # Pasos entre cambios de semáforo y radio con el que los coches Dijkstra
+        # buscan estacionamiento
+        self.light_interval = light_interval
+        self.detection_radius = detection_radius
+        # Índices de agentes fijos del mapa. Edificios, glorieta, estacionamientos
+        # y banquetas no hacen nada en step(), así que solo viven en el grid y
+        # aquí; el schedule contiene únicamente coches y semáforos.
+        self.static_agents = []
+        self.parkings_by_pos = {}
+        self.traffic_lights = []
+        # Estacionamiento -> coches con ruta hacia él, y estacionamientos que
+        # cambiaron desde el último step
+        self.route_watchers = {}
+        self.changed_parkings = []
+        # Contador de cambios de estacionamientos; lo usa el motor vectorial para
+        # saber si su campo de distancias sigue vigente
+        self.parking_changes = 0
+
+        self.load_scenario(self.scenario)
+
+        self.occupancy = self.build_occupancy()
+
+        # Con engine="vector" los coches se avanzan en arreglos NumPy (ver engine.py)
+        if engine not in ("agents", "vector"):
+            raise ValueError(f"Motor desconocido: {engine}")
+        self.engine = VectorEngine(self) if engine == "vector" else None
+
+        if self.precompute_routes:
+            self._routing_table = self.load_or_build_routing_table()
+
+        # Agregados por tick en columnas NumPy (ver metrics.py); la fila 0 es el estado inicial
+        self.metrics = None
+        if collect_metrics:
+            self.metrics = MetricsCollector(self)
+            self.metrics.collect()
+
+        if profile:
+            self.instrument_profiler()
+
+    def load_scenario(self, scenario):
+        """Construye calles, agentes fijos y coches a partir de un Scenario"""
+        width, height = self.grid.width, self.grid.height
+        # width/height pueden achicar el grid por debajo del tamaño del escenario
+        scenario.check_bounds(width, height)
+
+        # Calles por bloques: una asignación NumPy por rectángulo en lugar de una por celda
+        for x0, x1, y0, y1, direction in scenario.streets:
+            self.street_directions.fill(range(x0, x1), range(y0, y1), direction)
+        for x, y, directions in scenario.intersections:
+            self.street_directions[(x, y)] = directions
 
         # Colocar edificios
         agent_id = 0
-        for x, y, w, h in buildings:
-            for i in range(w):
-                for j in range(h):
-                    if 0 <= x+i < width and 0 <= y+j < height:
-                        agent = BuildingAgent(agent_id, self)
-                        self.grid.place_agent(agent, (x+i, y+j))
-                        self.schedule.add(agent)
-                        agent_id += 1
+        for x, y, w, h in scenario.buildings:
+            for i in range(x, x + w):
+                for j in range(y, y + h):
+                    agent = BuildingAgent(agent_id, self)
+                    self.grid.place_agent(agent, (i, j))
+                    self.static_agents.append(agent)
+                    agent_id += 1
 
         # Colocar estacionamientos
-        for x, y, num in parkings:
+        for x, y, num in scenario.parkings:
             agent = ParkingAgent(agent_id, self, num)
             self.grid.place_agent(agent, (x, y))
-            self.schedule.add(agent)
+            self.static_agents.append(agent)
+            self.parkings_by_pos[(x, y)] = agent
             agent_id += 1
 
         # Colocar semáforos y aceras
-        for tl_x, tl_y, tl_height, sw_x, sw_y, sw_width in traffic_light_sidewalks:
+        for tl_x, tl_y, tl_height, sw_x, sw_y, sw_width in scenario.traffic_lights:
             traffic_light = TrafficLightAgent(agent_id, self)
             self.grid.place_agent(traffic_light, (tl_x, tl_y))
             self.schedule.add(traffic_light)
+            self.traffic_lights.append(traffic_light)
+            traffic_light.cells.append((tl_x, tl_y))
             agent_id += 1
 
             for j in range(1, tl_height):
                 self.grid.place_agent(traffic_light, (tl_x, tl_y + j))
+                traffic_light.cells.append((tl_x, tl_y + j))
 
             for i in range(sw_width):
                 sidewalk_agent = SidewalkAgent(agent_id, self, traffic_light)
                 self.grid.place_agent(sidewalk_agent, (sw_x + i, sw_y))
-                self.schedule.add(sidewalk_agent)
+                self.static_agents.append(sidewalk_agent)
+                traffic_light.sidewalks.append(sidewalk_agent)
                 agent_id += 1
 
         # Colocar glorieta
-        for x, y in roundabout:
+        for x, y in scenario.roundabout:
             agent = RoundaboutAgent(agent_id, self)
             self.grid.place_agent(agent, (x, y))
-            self.schedule.add(agent)
+            self.static_agents.append(agent)
             agent_id += 1
 
-        # Crear coches
-
-        # Prueba aglomeración de coches
-        # Todos 2 y 1 desobediente
-        #start_positions = [(0,22), (0,23), (23,23), (23,0), (15,15), (2,0), (15,0), (15,10), (20,20)] 
-
-        # Prueba para ceder el paso
-        # 4 normales 
-        start_positions = [(0,23), (23,0), (23,23), (0,0), (7, 5), (12, 17), (13, 22), (18, 1), (22, 16)] # 9
-        #start_positions = [(7, 5), (12, 17), (13, 22), (18, 1), (22, 16), (15, 1), (22, 11)]
-        #start_positions = [(0,23), (23,0), (23,23), (0,0), (7, 5), (12, 17), (13, 22), (18, 1), (22, 16), (15, 1), (22, 11), (21,21), (2,2), (7, 7), (11, 18), (10, 22), (15, 1), (20, 13), (12, 1), (19, 11)] # 20
-
-        available_positions = start_positions.copy()
-
-        # Número de coches por tipo
-        num_normal_cars = 2
-        num_fast_cars = 2
-        num_slow_cars = 2 # 11
-        num_disobedient_cars = 1
-        num_dijkstra_cars = 2
-
-        # Crear coches normales
-        for _ in range(num_normal_cars):
-            if available_positions:
-                pos = self.random.choice(available_positions)
-                if self.grid.is_cell_empty(pos):  # Validar que la celda esté vacía
-                    car = NormalCarAgent(self.next_id(), self, pos)
-                    self.grid.place_agent(car, pos)
-                    self.schedule.add(car)
-                    available_positions.remove(pos)
-
-        # Crear coches rápidos
-        for _ in range(num_fast_cars):
-            if available_positions:
-                pos = self.random.choice(available_positions)
-                if self.grid.is_cell_empty(pos):  # Validar que la celda esté vacía
-                    car = FastCarAgent(self.next_id(), self, pos)
-                    self.grid.place_agent(car, pos)
-                    self.schedule.add(car)
-                    available_positions.remove(pos)
-
-        # Crear coches lentos
-        for _ in range(num_slow_cars):
-            if available_positions:
-                pos = self.random.choice(available_positions)
-                if self.grid.is_cell_empty(pos):  # Validar que la celda esté vacía
-                    car = SlowCarAgent(self.next_id(), self, pos)
-                    self.grid.place_agent(car, pos)
-                    self.schedule.add(car)
-                    available_positions.remove(pos)
-
-        # Crear coches desobedientes
-        for _ in range(num_disobedient_cars):
-            if available_positions:
-                pos = self.random.choice(available_positions)
-                if self.grid.is_cell_empty(pos):  # Validar que la celda esté vacía
-                    car = DisobedientCarAgent(self.next_id(), self, pos)
-                    self.grid.place_agent(car, pos)
-                    self.schedule.add(car)
-                    available_positions.remove(pos)
-
-        # Crear coches Dijkstra
-        for _ in range(num_dijkstra_cars):
-            if available_positions:
-                pos = self.random.choice(available_positions)
-                if self.grid.is_cell_empty(pos):  # Validar que la celda esté vacía
-                    car = DijkstraCarAgent(self.next_id(), self, pos)
-                    self.grid.place_agent(car, pos)
-                    self.schedule.add(car)
-                    available_positions.remove(pos)
+        # Crear coches por tipo, en el orden de la flota
+        if scenario.start_positions is not None:
+            available_positions = list(scenario.start_positions)
+            for car_type, count in scenario.fleet.items():
+                for _ in range(count):
+                    if available_positions:
+                        pos = self.random.choice(available_positions)
+                        if self.grid.is_cell_empty(pos):  # Validar que la celda esté vacía
+                            self.add_car(CAR_TYPES[car_type], pos)
+                            available_positions.remove(pos)
+        else:
+            # Sin posiciones fijas: una sola muestra entre todas las calles vacías
+            candidates = [pos for pos in self.street_directions if self.grid.is_cell_empty(pos)]
+            positions = iter(self.random.sample(candidates, min(scenario.car_count, len(candidates))))
+            for car_type, count in scenario.fleet.items():
+                for _, pos in zip(range(count), positions):
+                    self.add_car(CAR_TYPES[car_type], pos)
+
+    def instrument_profiler(self):
+        """Cronometra los métodos de agentes, modelo y motor que corren en cada tick"""
+        stages = [stage for stage in STAGES if not stage.startswith("model.")]
+        agent_methods = ["step", "check_available_parkings"] + stages
+        for agent in self.schedule.agents:
+            self.profiler.instrument(agent, agent_methods)
+        self.profiler.instrument(self, ["stage_moves", "free_parkings_near"])
+        if self.engine is not None:
+            self.profiler.instrument(self.engine, ["build_parking_field", "change_lanes", "move", "sync_agents"])
+
+    def add_car(self, car_class, pos):
+        car = car_class(self.next_id(), self, pos)
+        self.grid.place_agent(car, pos)
+        self.schedule.add(car)
+        return car
+
+    def build_occupancy(self):
+        """Capa de ocupación (coches, señales en rojo, estacionamientos libres, obstáculos)"""
+        occupancy = Occupancy(self.grid.width, self.grid.height)
+        # Recorrer solo los agentes, no todas las celdas del grid
+        for agent in self.schedule.agents:
+            if isinstance(agent, NormalCarAgent):
+                occupancy.add_car(agent.pos)
+        for agent in self.static_agents:
+            if isinstance(agent, (BuildingAgent, RoundaboutAgent)):
+                occupancy.add_obstacle(agent.pos)
+        for pos, parking in self.parkings_by_pos.items():
+            occupancy.set_free_parking(pos, not parking.occupied)
+        for traffic_light in self.traffic_lights:
+            occupancy.add_light(traffic_light)
+        return occupancy
+
+    def car_agents(self):
+        """Coches del modelo; en modo vectorial con el estado copiado de los arreglos"""
+        if self.engine is not None:
+            return self.engine.sync_agents()
+        return [agent for agent in self.schedule.agents if isinstance(agent, NormalCarAgent)]
+
+    def free_parking_count(self):
+        """Número de estacionamientos libres, sin recorrer los agentes"""
+        return len(self.occupancy.free_parkings)
+
+    def parking_changed(self, parking):
+        """Registra que un estacionamiento cambió de estado (lo llama ParkingAgent)"""
+        self.occupancy.set_free_parking(parking.pos, not parking.occupied)
+        self.changed_parkings.append(parking.pos)
+        self.parking_changes += 1
+
+    def watch_parking(self, car, pos):
+        self.route_watchers.setdefault(pos, set()).add(car)
+
+    def unwatch_parking(self, car, pos):
+        watchers = self.route_watchers.get(pos)
+        if watchers is not None:
+            watchers.discard(car)
+            if not watchers:
+                del self.route_watchers[pos]
+
+    def is_parking_free(self, pos):
+        return pos in self.occupancy.free_parkings
+
+    def free_parkings_near(self, pos, radius):
+        """Posiciones de estacionamientos libres dentro de un radio (distancia Manhattan)"""
+        return self.occupancy.parking_index.free_within(pos, radius)
+
+    @property
+    def street_graph(self):
+        """Grafo de calles compartido por todos los coches que calculan rutas"""
+        if self._street_graph is None:
+            with self.profiler.phase("street_graph"):
+                self._street_graph = StreetGraph(self)
+        return self._street_graph
+
+    def invalidate_street_graph(self):
+        """Descarta el grafo para que se reconstruya completo en la siguiente consulta"""
+        self._street_graph = None
+        self._routing_table = None
+
+    def load_or_build_routing_table(self):
+        """Carga la tabla de rutas de routes_file si coincide con el mapa actual;
+        si no, la calcula y la guarda ahí"""
+        signature = RoutingTable.graph_signature(self.street_graph)
+        if self.routes_file and os.path.exists(self.routes_file):
+            table = RoutingTable.load(self.routes_file)
+            if table.signature == signature and (table.width, table.height) == (self.grid.width, self.grid.height):
+                return table
+        with self.profiler.phase("routing_table"):
+            table = RoutingTable.from_graph(self.street_graph, self.grid.width, self.grid.height)
+        if self.routes_file:
+            table.save(self.routes_file)
+        return table
+
+    @property
+    def routing_table(self):
+        if self._routing_table is None and self.precompute_routes:
+            self._routing_table = self.load_or_build_routing_table()
+        return self._routing_table
+
+    @property
+    def route_finder(self):
+        """Objeto con find_shortest_path: la tabla precalculada si está activa, si no el grafo"""
+        return self.routing_table or self.street_graph
+
+    def set_street_direction(self, pos, direction):
+        """Cambia (o elimina con None) la dirección de una celda de calle
+        y parcha el grafo en lugar de reconstruirlo"""
+        if direction is None:
+            self.street_directions.pop(pos, None)
+        else:
+            self.street_directions[pos] = direction
+        if self._street_graph is not None:
+            self._street_graph.update_cell(pos)
+        # La tabla precalculada ya no corresponde al mapa
+        self._routing_table = None
+        if self.engine is not None:
+            self.engine.build_road_tables()
+
+    def staged_cars(self):
+        """Coches sin estacionar en orden de unique_id, el orden fijo del modo por etapas"""
+        cars = [agent for agent in self.schedule.agents if isinstance(agent, NormalCarAgent) and not agent.parked]
+        cars.sort(key=lambda car: car.unique_id)
+        return cars
+
+    @staticmethod
+    def resolve_targets(proposals):
+        """Entre los coches que quieren la misma celda gana el que lleva más tiempo
+        esperando y, si empatan, el de menor unique_id. Devuelve el conjunto de ganadores."""
+        winners = {}
+        for car, pos in proposals:
+            current = winners.get(pos)
+            if current is None or (-car.tiempo_espera, car.unique_id) < (-current.tiempo_espera, current.unique_id):
+                winners[pos] = car
+        return set(winners.values())
+
+    def resolve_moves(self, intents):
+        """Coches de intents ({coche: (acción, celda)}) que sí avanzan, en el orden
+        en que hay que aplicar sus movimientos.
+
+        Después de resolve_targets, un coche entra a una celda ocupada solo si el
+        coche que está ahí también avanza en esta ronda, así que una fila de coches
+        se mueve completa. Si los coches forman un ciclo (cada uno quiere la celda
+        del siguiente) ninguno avanza, igual que en el modo secuencial.
+        """
+        winners = self.resolve_targets(
+            [(car, pos) for car, (action, pos) in intents.items() if action in (MOVE, PARK)]
+        )
+        targets = {car: intents[car][1] for car in intents if car in winners}
+        leaving = {car.pos: car for car in targets}
+        has_car = self.occupancy.has_car
+        valid = {}
+        order = []
+        for car in targets:
+            if car in valid:
+                continue
+            # Seguir la fila hacia adelante hasta una celda libre, un coche que no
+            # avanza, un ciclo o un coche ya resuelto
+            chain = [car]
+            in_chain = {car}
+            while True:
+                target = targets[chain[-1]]
+                if not has_car(target):
+                    ok = True
+                    break
+                leader = leaving.get(target)
+                if leader in valid:
+                    ok = valid[leader]
+                    break
+                if leader is None or leader in in_chain:
+                    ok = False
+                    break
+                chain.append(leader)
+                in_chain.add(leader)
+            for member in chain:
+                valid[member] = ok
+            if ok:
+                # El de adelante primero, para que su celda ya esté libre
+                order.extend(reversed(chain))
+        return order
+
+    def longest_wait_into(self, pos):
+        """Mayor tiempo de espera entre los coches vecinos cuya calle lleva a pos"""
+        longest = -1
+        for car in self.grid.get_neighbors(pos, moore=False):
+            if isinstance(car, NormalCarAgent) and not car.parked:
+                for _, dx, dy in self.street_directions.moves(car.pos):
+                    if (car.pos[0] + dx, car.pos[1] + dy) == pos:
+                        longest = max(longest, car.tiempo_espera)
+        return longest
+
+    def change_stalled_lanes(self, cars):
+        """Cambio de carril de los coches enojados que no pudieron avanzar.
+
+        Un coche no se cambia a una celda por la que espera entrar, por su calle,
+        un coche que lleva más tiempo esperando; sin esta regla un coche que va y
+        viene entre dos carriles puede bloquear la misma celda cada tick.
+        """
+        proposals = []
+        for car in cars:
+            adj_pos = car.propose_lane_change()
+            if adj_pos is not None and self.longest_wait_into(adj_pos) <= car.tiempo_espera:
+                proposals.append((car, adj_pos))
+        winners = self.resolve_targets(proposals)
+        for car, adj_pos in proposals:
+            if car in winners:
+                car.commit_lane_change(adj_pos)
+        return winners
+
+    def stage_moves(self):
+        """Propone, resuelve y aplica los movimientos de todos los coches.
+
+        Cada ronda las propuestas leen el mismo estado del grid, así que el
+        resultado no depende del orden en que se calculan; una celda ocupada
+        cuenta como libre si su coche avanza en la misma ronda (resolve_moves).
+        Un coche enojado que no pudo avanzar cambia de carril, una vez por tick.
+        FastCarAgent participa en tantas rondas como su velocidad.
+        """
+        cars = self.staged_cars()
+        changed_lane = set()
+        for round_number in range(max((car.move_rounds for car in cars), default=0)):
+            active = [car for car in cars if car.move_rounds > round_number and not car.parked]
+            intents = {}
+            for car in active:
+                intent = car.propose_move(ignore_cars=True)
+                if intent is not None:
+                    intents[car] = intent
+
+            moving = self.resolve_moves(intents)
+            for car in moving:
+                car.commit_move(*intents[car])
+            moved = set(moving)
+            # Los que no avanzaron, incluidos los que no tenían hacia dónde (p. ej.
+            # DisobedientCarAgent en un cruce), pueden cambiar de carril
+            stalled = []
+            for car in active:
+                if car in moved:
+                    continue
+                if car in intents:
+                    action, pos = intents[car]
+                    car.commit_move(WAIT if action in (MOVE, PARK) else action, pos)
+                if car not in changed_lane and not car.parked and car.wants_lane_change():
+                    stalled.append(car)
+            changed_lane |= self.change_stalled_lanes(stalled)
 
     def step(self):
-        # Iterar sobre los agentes y validar disponibilidad de estacionamientos
-        for agent in self.schedule.agents:
-            if isinstance(agent, DijkstraCarAgent) and agent.path_to_parking:
-                # Validar si el parking sigue disponible
-                target_position = agent.path_to_parking[-1]
-                parking_agents = [
-                    a for a in self.grid.get_cell_list_contents([target_position])
-                    if isinstance(a, ParkingAgent)
-                ]
-                if not parking_agents or parking_agents[0].occupied:
-                    agent.path_to_parking = None  # Invalidar el camino si el parking ya no está disponible
-
-        self.schedule.step()
+        profiler = self.profiler
+        with profiler.phase("step"):
+            with profiler.phase("route_invalidation"):
+                self.invalidate_parking_routes()
+            if self.engine is not None:
+                with profiler.phase("engine"):
+                    self.engine.step()
+            with profiler.phase("schedule"):
+                self.schedule.step()
+            if self.metrics is not None:
+                with profiler.phase("metrics"):
+                    self.metrics.collect()
+
+    def invalidate_parking_routes(self):
+        """Invalida solo las rutas de los coches que iban a un estacionamiento que se ocupó"""
+        changed_parkings, self.changed_parkings = self.changed_parkings, []
+        for pos in changed_parkings:
+            if not self.parkings_by_pos[pos].occupied:
+                continue
+            for car in list(self.route_watchers.get(pos, ())):
+                car.path_to_parking = None  # Invalidar el camino si el parking ya no está disponible
 
 def agent_portrayal(agent):
     if agent is None:
@@ -0,0 +1,165 @@
+import numpy as np
+
+# Bits por celda
+CAR = 1
+RED_LIGHT = 2
+RED_SIDEWALK = 4
+FREE_PARKING = 8
+# Edificios y glorieta: los coches normales no entran a estas celdas
+OBSTACLE = 16
+
+# Cualquier cosa que impide que un coche entre a la celda
+BLOCKED = CAR | RED_LIGHT | RED_SIDEWALK
+
+
+class ParkingIndex:
+    """Índice espacial por cubetas de los estacionamientos libres.
+
+    Cada cubeta cubre bucket_size x bucket_size celdas y guarda solo las
+    posiciones libres, así una consulta por radio revisa únicamente las cubetas
+    que tocan el área y los estacionamientos libres que hay en ellas.
+    """
+
+    def __init__(self, bucket_size=8):
+        self.bucket_size = bucket_size
+        self.buckets = {}
+
+    def _bucket(self, pos):
+        return (pos[0] // self.bucket_size, pos[1] // self.bucket_size)
+
+    def set_free(self, pos, free):
+        bucket = self._bucket(pos)
+        if free:
+            self.buckets.setdefault(bucket, set()).add(pos)
+        elif bucket in self.buckets:
+            self.buckets[bucket].discard(pos)
+
+    def free_within(self, pos, radius):
+        """Estacionamientos libres a distancia Manhattan <= radius de pos (sin incluir pos),
+        en el mismo orden (x, y) en que los devuelve grid.iter_neighbors"""
+        x, y = pos
+        size = self.bucket_size
+        found = []
+        for bx in range((x - radius) // size, (x + radius) // size + 1):
+            for by in range((y - radius) // size, (y + radius) // size + 1):
+                for spot in self.buckets.get((bx, by), ()):
+                    distance = abs(spot[0] - x) + abs(spot[1] - y)
+                    if 0 < distance <= radius:
+                        found.append(spot)
+        found.sort()
+        return found
+
+
+class Occupancy:
+    """Capa de ocupación mantenida por el modelo.
+
+    flags guarda por celda los bits CAR, RED_LIGHT, RED_SIDEWALK, FREE_PARKING y OBSTACLE,
+    de modo que saber si un coche puede entrar a una celda es una sola lectura.
+    Se actualiza de forma incremental cuando un coche se mueve, un estacionamiento
+    cambia de estado o un semáforo cambia de color. Los contadores por celda
+    permiten que varias entidades compartan la misma celda.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        size = width * height
+        self._flags = bytearray(size)
+        self._cars = bytearray(size)
+        self._red_lights = bytearray(size)
+        self._red_sidewalks = bytearray(size)
+        self.flags = np.frombuffer(self._flags, dtype=np.uint8).reshape(width, height)
+        # Posiciones de estacionamientos libres, para contarlos sin recorrer agentes
+        self.free_parkings = set()
+        self.parking_index = ParkingIndex()
+
+    def _index(self, pos):
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return x * self.height + y
+        return -1
+
+    def _refresh(self, index):
+        flags = self._flags[index] & (FREE_PARKING | OBSTACLE)
+        if self._cars[index]:
+            flags |= CAR
+        if self._red_lights[index]:
+            flags |= RED_LIGHT
+        if self._red_sidewalks[index]:
+            flags |= RED_SIDEWALK
+        self._flags[index] = flags
+
+    def flags_at(self, pos):
+        index = self._index(pos)
+        return self._flags[index] if index >= 0 else 0
+
+    def blocked(self, pos):
+        """True si hay un coche o una señal en rojo en la celda"""
+        index = self._index(pos)
+        return index >= 0 and bool(self._flags[index] & BLOCKED)
+
+    def has_car(self, pos):
+        index = self._index(pos)
+        return index >= 0 and bool(self._flags[index] & CAR)
+
+    def is_free_parking(self, pos):
+        index = self._index(pos)
+        return index >= 0 and bool(self._flags[index] & FREE_PARKING)
+
+    def add_car(self, pos):
+        index = self._index(pos)
+        self._cars[index] += 1
+        self._flags[index] |= CAR
+
+    def remove_car(self, pos):
+        index = self._index(pos)
+        self._cars[index] -= 1
+        if not self._cars[index]:
+            self._flags[index] &= ~CAR & 0xFF
+
+    def move_car(self, old_pos, new_pos):
+        self.remove_car(old_pos)
+        self.add_car(new_pos)
+
+    def move_cars(self, old_cells, new_cells):
+        """move_car para muchos coches a la vez; las celdas son índices x * height + y"""
+        cars = np.frombuffer(self._cars, dtype=np.uint8)
+        flags = np.frombuffer(self._flags, dtype=np.uint8)
+        np.subtract.at(cars, old_cells, 1)
+        np.add.at(cars, new_cells, 1)
+        touched = np.concatenate((old_cells, new_cells))
+        flags[touched] = (flags[touched] & (0xFF ^ CAR)) | np.where(cars[touched] > 0, CAR, 0).astype(np.uint8)
+
+    def set_free_parking(self, pos, free):
+        index = self._index(pos)
+        if free:
+            self._flags[index] |= FREE_PARKING
+            self.free_parkings.add(pos)
+            self.parking_index.set_free(pos, True)
+        else:
+            self._flags[index] &= ~FREE_PARKING & 0xFF
+            self.free_parkings.discard(pos)
+            self.parking_index.set_free(pos, False)
+
+    def add_obstacle(self, pos):
+        index = self._index(pos)
+        self._flags[index] |= OBSTACLE
+
+    def add_light(self, light):
+        """Registra las celdas de un semáforo y sus banquetas según su color actual"""
+        self._apply_light(light, light.state == "red", 1)
+
+    def light_changed(self, light):
+        """Actualiza las celdas después de que un semáforo cambió de color"""
+        is_red = light.state == "red"
+        self._apply_light(light, not is_red, -1)
+        self._apply_light(light, is_red, 1)
+
+    def _apply_light(self, light, red, delta):
+        # El semáforo bloquea en rojo; sus banquetas bloquean cuando está en verde
+        light_counts = self._red_lights if red else self._red_sidewalks
+        cells = light.cells if red else [sidewalk.pos for sidewalk in light.sidewalks]
+        for pos in cells:
+            index = self._index(pos)
+            light_counts[index] += delta
+            self._refresh(index)
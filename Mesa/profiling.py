@@ -0,0 +1,132 @@
+# profiling.py
+"""Tiempos por fase de TrafficModel.step y por clase de agente.
+
+Con TrafficModel(profile=True) el modelo mide cada fase de step() (invalidación
+de rutas, motor vectorial, schedule, métricas), la construcción del grafo de
+calles y de la tabla de rutas, y los métodos de los agentes y del motor que
+se ejecutan en cada tick, agrupados por clase (p. ej. "FastCarAgent.step").
+
+Los métodos se miden reemplazándolos en cada instancia por una versión
+cronometrada, así que con profile=False no hay ningún costo en ellos; las
+fases de step() usan NullProfiler, cuyo phase() devuelve siempre el mismo
+contexto vacío.
+"""
+import time
+from contextlib import nullcontext
+
+_NULL_PHASE = nullcontext()
+
+
+class NullProfiler:
+    """Profiler desactivado: no mide nada"""
+
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def instrument(self, obj, methods, prefix=None):
+        pass
+
+    def report(self):
+        return []
+
+
+class _Phase:
+    __slots__ = ("stats", "start")
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info):
+        self.stats[0] += 1
+        self.stats[1] += time.perf_counter_ns() - self.start
+
+
+class StepProfiler:
+    """Acumula llamadas y nanosegundos por nombre de fase o método.
+
+    Las fases pueden anidarse; cada una cuenta su tiempo total, incluido el de
+    las fases internas.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        # nombre -> [llamadas, nanosegundos]
+        self.stats = {}
+
+    def _stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = [0, 0]
+        return stats
+
+    def phase(self, name):
+        return _Phase(self._stats(name))
+
+    def timed(self, name, method):
+        stats = self._stats(name)
+        clock = time.perf_counter_ns
+
+        def timed_method(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats[0] += 1
+                stats[1] += clock() - start
+
+        return timed_method
+
+    def instrument(self, obj, methods, prefix=None):
+        """Reemplaza en obj los métodos indicados por versiones cronometradas,
+        nombradas "<prefix o clase>.<método>"; los que obj no tiene se ignoran"""
+        prefix = prefix or type(obj).__name__
+        for name in methods:
+            method = getattr(obj, name, None)
+            if method is not None:
+                setattr(obj, name, self.timed(f"{prefix}.{name}", method))
+
+    def reset(self):
+        for stats in self.stats.values():
+            stats[0] = stats[1] = 0
+
+    def report(self):
+        """Filas ordenadas por tiempo total. percent es respecto al total de "step"
+        (street_graph y routing_table se construyen fuera de step y pueden pasar de 100).
+
+        Copia los contadores, así que se puede llamar desde otro hilo mientras el
+        modelo avanza (los números pueden estar a mitad de un tick).
+        """
+        stats = [(name, calls, nanoseconds) for name, (calls, nanoseconds) in list(self.stats.items())]
+        step_total = next((nanoseconds for name, _, nanoseconds in stats if name == "step"), 0)
+        rows = []
+        for name, calls, nanoseconds in sorted(stats, key=lambda row: row[2], reverse=True):
+            if not calls:
+                continue
+            rows.append({
+                "name": name,
+                "calls": calls,
+                "total_seconds": nanoseconds / 1e9,
+                "mean_microseconds": nanoseconds / calls / 1e3,
+                "percent": 100.0 * nanoseconds / step_total if step_total else 0.0,
+            })
+        return rows
+
+
+def format_report(rows):
+    """Tabla de texto con las filas de report()"""
+    if not rows:
+        return "(sin datos de perfilado)"
+    width = max(len(row["name"]) for row in rows)
+    lines = [f"{'fase':<{width}}  {'llamadas':>10}  {'total s':>10}  {'media us':>10}  {'% step':>7}"]
+    for row in rows:
+        lines.append(
+            f"{row['name']:<{width}}  {row['calls']:>10}  {row['total_seconds']:>10.4f}  "
+            f"{row['mean_microseconds']:>10.2f}  {row['percent']:>7.1f}"
+        )
+    return "\n".join(lines)
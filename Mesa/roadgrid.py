@@ -0,0 +1,165 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+
+# Bits de dirección permitida por celda
+RIGHT = 1
+LEFT = 2
+UP = 4
+DOWN = 8
+
+DIRECTION_BITS = {"right": RIGHT, "left": LEFT, "up": UP, "down": DOWN}
+DIRECTION_OFFSETS = {"right": (1, 0), "left": (-1, 0), "up": (0, 1), "down": (0, -1)}
+
+
+class RoadGrid(MutableMapping):
+    """Mapa de calles respaldado por arreglos de bytes.
+
+    Se comporta como el diccionario street_directions original
+    (posición -> "right" o ["right", "down"]), pero cada celda guarda solo un
+    código uint8. El código apunta a una tabla interna con la dirección tal como
+    se asignó (respetando el orden de las listas) y sus desplazamientos, y
+    masks guarda la máscara de bits de direcciones permitidas. codes y masks
+    son vistas NumPy (width, height) sobre la misma memoria.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._codes = bytearray(width * height)
+        self._masks = bytearray(width * height)
+        self.codes = np.frombuffer(self._codes, dtype=np.uint8).reshape(width, height)
+        self.masks = np.frombuffer(self._masks, dtype=np.uint8).reshape(width, height)
+        # Código 0 = no es calle
+        self._values = [None]
+        self._moves = [()]
+        self._single = [None]
+        self._code_masks = [0]
+        self._code_of = {}
+        self._count = 0
+
+    def _index(self, pos):
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return x * self.height + y
+        return -1
+
+    def _intern(self, value):
+        key = value if isinstance(value, str) else tuple(value)
+        code = self._code_of.get(key)
+        if code is not None:
+            return code
+        directions = (key,) if isinstance(key, str) else key
+        for direction in directions:
+            if direction not in DIRECTION_BITS:
+                raise ValueError(f"Dirección inválida: {direction}")
+        code = len(self._values)
+        if code > 255:
+            raise ValueError("Demasiadas combinaciones de direcciones distintas")
+        self._values.append(key)
+        self._moves.append(tuple((d,) + DIRECTION_OFFSETS[d] for d in directions))
+        self._single.append(DIRECTION_OFFSETS[key] if isinstance(key, str) else None)
+        mask = 0
+        for direction in directions:
+            mask |= DIRECTION_BITS[direction]
+        self._code_masks.append(mask)
+        self._code_of[key] = code
+        return code
+
+    def __getitem__(self, pos):
+        index = self._index(pos)
+        code = self._codes[index] if index >= 0 else 0
+        if not code:
+            raise KeyError(pos)
+        value = self._values[code]
+        return value if isinstance(value, str) else list(value)
+
+    def get(self, pos, default=None):
+        index = self._index(pos)
+        code = self._codes[index] if index >= 0 else 0
+        if not code:
+            return default
+        value = self._values[code]
+        return value if isinstance(value, str) else list(value)
+
+    def __setitem__(self, pos, value):
+        index = self._index(pos)
+        if index < 0:
+            raise KeyError(f"Posición fuera del mapa: {pos}")
+        code = self._intern(value)
+        if not self._codes[index]:
+            self._count += 1
+        self._codes[index] = code
+        self._masks[index] = self._code_masks[code]
+
+    def __delitem__(self, pos):
+        index = self._index(pos)
+        if index < 0 or not self._codes[index]:
+            raise KeyError(pos)
+        self._codes[index] = 0
+        self._masks[index] = 0
+        self._count -= 1
+
+    def __contains__(self, pos):
+        index = self._index(pos)
+        return index >= 0 and self._codes[index] != 0
+
+    def __iter__(self):
+        height = self.height
+        for index in np.flatnonzero(self.codes).tolist():
+            yield (index // height, index % height)
+
+    def __len__(self):
+        return self._count
+
+    def fill(self, xs, ys, value):
+        """Asigna la misma dirección a un bloque rectangular de celdas de una vez"""
+        # Como en __setitem__, nada fuera del mapa (un slice negativo daría la vuelta)
+        for block_range, size in ((xs, self.width), (ys, self.height)):
+            if isinstance(block_range, range) and not 0 <= block_range.start <= block_range.stop <= size:
+                raise KeyError(f"Bloque fuera del mapa: {xs}, {ys}")
+        code = self._intern(value)
+        xs = slice(xs.start, xs.stop) if isinstance(xs, range) else xs
+        ys = slice(ys.start, ys.stop) if isinstance(ys, range) else ys
+        block = self.codes[xs, ys]
+        self._count += int(np.count_nonzero(block == 0))
+        block[...] = code
+        self.masks[xs, ys] = self._code_masks[code]
+
+    def code(self, pos):
+        """Código interno de la celda (0 si no es calle)"""
+        index = self._index(pos)
+        return self._codes[index] if index >= 0 else 0
+
+    def mask(self, pos):
+        """Máscara de bits con las direcciones permitidas (0 si no es calle)"""
+        index = self._index(pos)
+        return self._masks[index] if index >= 0 else 0
+
+    def moves(self, pos):
+        """Tupla de (dirección, dx, dy) en el orden en que se asignaron"""
+        index = self._index(pos)
+        return self._moves[self._codes[index]] if index >= 0 else ()
+
+    def single_move(self, pos):
+        """(dx, dy) si la celda tiene una sola dirección (no lista), si no None"""
+        index = self._index(pos)
+        return self._single[self._codes[index]] if index >= 0 else None
+
+    def is_multi_code(self, code):
+        return code != 0 and not isinstance(self._values[code], str)
+
+    def code_mask(self, code):
+        return self._code_masks[code]
+
+    def move_table(self):
+        """Tablas por código para operar sobre todas las celdas a la vez: número de
+        direcciones (n,) e índice en DIRECTION_OFFSETS de cada una (n, 4), -1 si no hay"""
+        names = list(DIRECTION_OFFSETS)
+        counts = np.zeros(len(self._values), dtype=np.int8)
+        directions = np.full((len(self._values), len(names)), -1, dtype=np.int8)
+        for code, moves in enumerate(self._moves):
+            counts[code] = len(moves)
+            for k, (direction, _, _) in enumerate(moves):
+                directions[code, k] = names.index(direction)
+        return counts, directions
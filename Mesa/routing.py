@@ -0,0 +1,133 @@
+import hashlib
+from collections import deque
+
+import numpy as np
+
+
+class RoutingTable:
+    """Tabla precalculada de distancias y siguiente salto entre todas las celdas
+    del StreetGraph.
+
+    Cada celda se identifica con cell_id = x * height + y. Las matrices dist y
+    next_hop están indexadas por el índice compacto del nodo (node_of_cell[cell_id]);
+    -1 indica que no hay camino.
+    """
+
+    def __init__(self, width, height, cells, dist, next_hop, signature):
+        self.width = width
+        self.height = height
+        self.cells = cells
+        self.dist = dist
+        self.next_hop = next_hop
+        self.signature = signature
+        self.node_of_cell = np.full(width * height, -1, dtype=np.int32)
+        self.node_of_cell[cells] = np.arange(len(cells), dtype=np.int32)
+
+    @staticmethod
+    def graph_signature(street_graph):
+        """Huella del grafo para saber si una tabla guardada sigue siendo válida"""
+        edges = sorted(street_graph.graph.edges)
+        nodes = sorted(street_graph.graph.nodes)
+        return hashlib.sha1(repr((nodes, edges)).encode()).hexdigest()
+
+    @classmethod
+    def from_graph(cls, street_graph, width, height):
+        """Construye la tabla con una búsqueda en anchura inversa desde cada nodo"""
+        graph = street_graph.graph
+        nodes = list(graph.nodes)
+        count = len(nodes)
+        dtype = np.int16 if count < np.iinfo(np.int16).max else np.int32
+        index = {pos: i for i, pos in enumerate(nodes)}
+        cells = np.array([x * height + y for x, y in nodes], dtype=np.int32)
+        dist = np.full((count, count), -1, dtype=dtype)
+        next_hop = np.full((count, count), -1, dtype=dtype)
+
+        predecessors = graph.pred
+        for target, target_pos in enumerate(nodes):
+            # Recorrer aristas al revés: quien llega a "node" avanza hacia target por él
+            dist_to_target = dist[:, target]
+            hop_to_target = next_hop[:, target]
+            dist_to_target[target] = 0
+            queue = deque([target_pos])
+            while queue:
+                node_pos = queue.popleft()
+                node = index[node_pos]
+                for previous_pos in predecessors[node_pos]:
+                    previous = index[previous_pos]
+                    if dist_to_target[previous] != -1:
+                        continue
+                    dist_to_target[previous] = dist_to_target[node] + 1
+                    hop_to_target[previous] = node
+                    queue.append(previous_pos)
+
+        return cls(width, height, cells, dist, next_hop, cls.graph_signature(street_graph))
+
+    def save(self, path):
+        # Con un archivo abierto savez_compressed no agrega ".npz" al nombre
+        with open(path, "wb") as routes_file:
+            np.savez_compressed(
+                routes_file, width=self.width, height=self.height, cells=self.cells,
+                dist=self.dist, next_hop=self.next_hop, signature=self.signature
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                int(data["width"]), int(data["height"]), data["cells"],
+                data["dist"], data["next_hop"], str(data["signature"])
+            )
+
+    def _node(self, pos):
+        x, y = pos
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return -1
+        return int(self.node_of_cell[x * self.height + y])
+
+    def _pos(self, node):
+        cell = int(self.cells[node])
+        return (cell // self.height, cell % self.height)
+
+    def distance(self, start, target):
+        start_node, target_node = self._node(start), self._node(target)
+        if start_node < 0 or target_node < 0 or self.dist[start_node, target_node] < 0:
+            return float('inf')
+        return int(self.dist[start_node, target_node])
+
+    def next_step(self, start, target):
+        """Siguiente celda del camino más corto de start a target, o None"""
+        start_node, target_node = self._node(start), self._node(target)
+        if start_node < 0 or target_node < 0:
+            return None
+        hop = self.next_hop[start_node, target_node]
+        return self._pos(hop) if hop >= 0 else None
+
+    def path(self, start, target):
+        start_node, target_node = self._node(start), self._node(target)
+        if start_node < 0 or target_node < 0 or self.dist[start_node, target_node] < 0:
+            return None
+        path = [start]
+        node = start_node
+        while node != target_node:
+            node = int(self.next_hop[node, target_node])
+            path.append(self._pos(node))
+        return path
+
+    def find_shortest_path(self, start, parking_spots):
+        """Mismo contrato que StreetGraph.find_shortest_path pero con consultas a la tabla"""
+        start_node = self._node(start)
+        if start_node < 0:
+            return None, float('inf')
+        best_spot = None
+        min_distance = float('inf')
+        row = self.dist[start_node]
+        for parking_spot in parking_spots:
+            target = self._node(parking_spot)
+            if target < 0 or row[target] < 0:
+                continue
+            if row[target] < min_distance:
+                min_distance = int(row[target])
+                best_spot = parking_spot
+        if best_spot is None:
+            return None, min_distance
+        return self.path(start, best_spot), min_distance
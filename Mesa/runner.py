@@ -0,0 +1,150 @@
+# runner.py
+"""Ejecuta TrafficModel sin navegador, Flask ni Unity y reporta métricas.
+
+Uso:
+    python runner.py --steps 1000 --seed 7
+    python runner.py --steps 5000 --precompute-routes --json
+    python runner.py --steps 200 --city --width 200 --height 200 --cars 2000
+    python runner.py --scenario city.json
+    python runner.py --steps 2000 --metrics ticks.npz
+    python runner.py --steps 500 --engine vector --profile
+"""
+import argparse
+import json
+import time
+
+from metrics import check_export
+from model import TrafficModel
+from profiling import format_report
+from scenario import Scenario, generate_city
+from simlog import configure_logging
+
+
+def summarize(model):
+    """Métricas agregadas del estado actual de los coches"""
+    cars = model.car_agents()
+    waits = [car.tiempo_espera for car in cars if not car.parked]
+    return {
+        "cars": len(cars),
+        "parked": sum(1 for car in cars if car.parked),
+        "angry": sum(1 for car in cars if car.estado == "enojado"),
+        "waiting": sum(1 for wait in waits if wait > 0),
+        "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+        "max_wait": max(waits, default=0),
+        "free_parkings": model.free_parking_count(),
+    }
+
+
+def run(steps=1000, **model_kwargs):
+    """Crea un TrafficModel con model_kwargs, ejecuta steps pasos y devuelve las métricas"""
+    start = time.perf_counter()
+    model = TrafficModel(**model_kwargs)
+    setup_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.step()
+    run_seconds = time.perf_counter() - start
+
+    metrics = {
+        "steps": steps,
+        "setup_seconds": setup_seconds,
+        "run_seconds": run_seconds,
+        "steps_per_second": steps / run_seconds if run_seconds > 0 else float("inf"),
+    }
+    metrics.update(summarize(model))
+    return model, metrics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulación de tráfico sin interfaz")
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--width", type=int, default=None,
+                        help="tamaño del grid (por defecto el del escenario; 200 con --city)")
+    parser.add_argument("--height", type=int, default=None)
+    parser.add_argument("--scenario", default=None, help="archivo JSON con el mapa y la flota")
+    parser.add_argument("--city", action="store_true",
+                        help="generar una ciudad en cuadrícula de width x height")
+    parser.add_argument("--cars", type=int, default=1000, help="coches de la ciudad generada")
+    parser.add_argument("--block-size", type=int, default=8, help="tamaño de manzana de la ciudad generada")
+    parser.add_argument("--precompute-routes", action="store_true",
+                        help="usar la tabla precalculada de rutas")
+    parser.add_argument("--routes-file", default=None,
+                        help="archivo .npz para cargar/guardar la tabla de rutas")
+    parser.add_argument("--engine", choices=["agents", "vector"], default="agents",
+                        help="avanzar los coches como agentes o en arreglos NumPy")
+    parser.add_argument("--step-mode", choices=["sequential", "staged"], default="sequential",
+                        help="mover los coches uno por uno o por etapas (proponer/resolver/aplicar)")
+    parser.add_argument("--light-interval", type=int, default=10, help="pasos entre cambios de semáforo")
+    parser.add_argument("--detection-radius", type=int, default=3,
+                        help="distancia a la que los coches Dijkstra buscan estacionamiento")
+    parser.add_argument("--log-level", default=None,
+                        help="mostrar mensajes de los agentes desde este nivel (p. ej. DEBUG)")
+    parser.add_argument("--trace", default=None, help="guardar la traza binaria de eventos en este archivo")
+    parser.add_argument("--metrics", default=None,
+                        help="guardar las métricas por tick en este archivo (.npz o .parquet)")
+    parser.add_argument("--profile", action="store_true",
+                        help="medir el tiempo de cada fase del paso y de cada clase de agente")
+    parser.add_argument("--json", action="store_true", help="imprimir las métricas como JSON")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        # Fallar antes de simular, no después de toda la corrida
+        try:
+            check_export(args.metrics)
+        except ImportError as error:
+            parser.error(str(error))
+
+    if args.log_level:
+        configure_logging(args.log_level.upper())
+
+    scenario = None
+    if args.scenario:
+        scenario = Scenario.load(args.scenario)
+    elif args.city:
+        scenario = generate_city(
+            args.width or 200, args.height or 200, block_size=args.block_size,
+            cars=args.cars, seed=args.seed,
+        )
+
+    model, metrics = run(
+        steps=args.steps,
+        width=args.width,
+        height=args.height,
+        scenario=scenario,
+        engine=args.engine,
+        step_mode=args.step_mode,
+        light_interval=args.light_interval,
+        detection_radius=args.detection_radius,
+        precompute_routes=args.precompute_routes,
+        routes_file=args.routes_file,
+        seed=args.seed,
+        trace=args.trace is not None,
+        collect_metrics=args.metrics is not None,
+        profile=args.profile,
+    )
+
+    if args.trace:
+        model.trace.save(args.trace)
+        metrics["trace_events"] = len(model.trace)
+
+    if args.metrics:
+        model.metrics.save(args.metrics)
+
+    if args.profile:
+        metrics["profile"] = model.profiler.report()
+
+    if args.json:
+        print(json.dumps(metrics))
+    else:
+        profile = metrics.pop("profile", None)
+        for key, value in metrics.items():
+            print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+        if profile is not None:
+            print()
+            print(format_report(profile))
+
+
+if __name__ == '__main__':
+    main()
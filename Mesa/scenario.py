@@ -0,0 +1,340 @@
+# scenario.py
+"""Escenarios: mapa y flota de TrafficModel descritos como datos.
+
+Un escenario se guarda como JSON con estas llaves (coordenadas en celdas):
+
+    width, height      tamaño del mapa
+    streets            [x0, x1, y0, y1, dirección]: bloque de calle con rangos
+                       semiabiertos [x0, x1) x [y0, y1); se aplican en orden
+    intersections      [x, y, [direcciones]]: celdas de cruce (una dirección o
+                       varias opciones), se aplican después de streets
+    buildings          [x, y, ancho, alto]
+    parkings           [x, y, número]
+    traffic_lights     [x, y, alto, x_banqueta, y_banqueta, ancho_banqueta]
+    roundabout         [x, y]
+    start_positions    [x, y] posibles para los coches, o null para elegir
+                       entre todas las calles libres
+    fleet              {"normal": n, "fast": n, "slow": n, "disobedient": n, "dijkstra": n}
+
+Uso:
+    python scenario.py --width 200 --height 200 --cars 2000 -o city.json
+"""
+import argparse
+import json
+import random
+
+from agents import DijkstraCarAgent, DisobedientCarAgent, FastCarAgent, NormalCarAgent, SlowCarAgent
+
+# Tipos de coche por nombre, en el orden en que se crean
+CAR_TYPES = {
+    "normal": NormalCarAgent,
+    "fast": FastCarAgent,
+    "slow": SlowCarAgent,
+    "disobedient": DisobedientCarAgent,
+    "dijkstra": DijkstraCarAgent,
+}
+
+SCENARIO_KEYS = (
+    "width", "height", "streets", "intersections", "buildings", "parkings",
+    "traffic_lights", "roundabout", "start_positions", "fleet",
+)
+
+
+class Scenario:
+    """Mapa y flota de un TrafficModel"""
+
+    def __init__(self, width, height, streets=(), intersections=(), buildings=(), parkings=(),
+                 traffic_lights=(), roundabout=(), start_positions=None, fleet=None):
+        self.width = width
+        self.height = height
+        self.streets = [tuple(street) for street in streets]
+        self.intersections = [
+            (x, y, directions if isinstance(directions, str) else list(directions))
+            for x, y, directions in intersections
+        ]
+        self.buildings = [tuple(building) for building in buildings]
+        self.parkings = [tuple(parking) for parking in parkings]
+        self.traffic_lights = [tuple(light) for light in traffic_lights]
+        self.roundabout = [tuple(pos) for pos in roundabout]
+        self.start_positions = None if start_positions is None else [tuple(pos) for pos in start_positions]
+        self.fleet = dict(fleet or {})
+        unknown = set(self.fleet) - set(CAR_TYPES)
+        if unknown:
+            raise ValueError(f"Tipos de coche desconocidos: {', '.join(sorted(unknown))}")
+        self.check_bounds(self.width, self.height)
+
+    def out_of_bounds(self, width, height):
+        """Elementos del escenario con alguna celda fuera de un mapa de width x height"""
+        def inside(x, y):
+            return 0 <= x < width and 0 <= y < height
+
+        def inside_block(x0, x1, y0, y1):
+            return 0 <= x0 <= x1 <= width and 0 <= y0 <= y1 <= height
+
+        invalid = []
+        invalid += [("streets", street) for street in self.streets if not inside_block(*street[:4])]
+        invalid += [("intersections", cell) for cell in self.intersections if not inside(*cell[:2])]
+        invalid += [("buildings", (x, y, w, h)) for x, y, w, h in self.buildings
+                    if not inside_block(x, x + w, y, y + h)]
+        invalid += [("parkings", parking) for parking in self.parkings if not inside(*parking[:2])]
+        invalid += [
+            ("traffic_lights", light) for light in self.traffic_lights
+            if not inside_block(light[0], light[0] + 1, light[1], light[1] + light[2])
+            or not inside_block(light[3], light[3] + light[5], light[4], light[4] + 1)
+        ]
+        invalid += [("roundabout", pos) for pos in self.roundabout if not inside(*pos)]
+        invalid += [("start_positions", pos) for pos in self.start_positions or () if not inside(*pos)]
+        return invalid
+
+    def check_bounds(self, width, height):
+        """ValueError si algún elemento no cabe en un mapa de width x height"""
+        invalid = self.out_of_bounds(width, height)
+        if invalid:
+            details = "; ".join(f"{key} {list(item)}" for key, item in invalid[:5])
+            more = f" (y {len(invalid) - 5} más)" if len(invalid) > 5 else ""
+            raise ValueError(f"Elementos fuera del mapa de {width}x{height}: {details}{more}")
+
+    @property
+    def car_count(self):
+        return sum(self.fleet.values())
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in SCENARIO_KEYS}
+
+    @classmethod
+    def from_dict(cls, data):
+        unknown = set(data) - set(SCENARIO_KEYS)
+        if unknown:
+            raise ValueError(f"Llaves desconocidas en el escenario: {', '.join(sorted(unknown))}")
+        return cls(**data)
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as scenario_file:
+            json.dump(self.to_dict(), scenario_file, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as scenario_file:
+            return cls.from_dict(json.load(scenario_file))
+
+
+def default_scenario():
+    """El mapa de 24x24 de la actividad integradora con su flota de 9 coches"""
+    return Scenario(
+        width=24,
+        height=24,
+        streets=[
+            # Calles largas del perímetro, dos carriles cada una
+            (0, 23, 0, 1, "right"),
+            (1, 22, 1, 2, "right"),
+            (0, 1, 1, 24, "down"),
+            (1, 2, 2, 23, "down"),
+            (23, 24, 0, 24, "up"),
+            (22, 23, 1, 22, "up"),
+            (1, 24, 23, 24, "left"),
+            (2, 23, 22, 23, "left"),
+            # Calles pequeñas entre estacionamientos y edificios
+            (2, 6, 4, 6, "left"),
+            (8, 12, 4, 6, "right"),
+            (8, 12, 17, 19, "left"),
+            (6, 8, 2, 8, "down"),
+            (6, 8, 12, 22, "up"),
+            (16, 22, 16, 18, "left"),
+            (18, 20, 2, 8, "up"),
+            # Calles centrales alrededor de la glorieta
+            (2, 12, 8, 10, "right"),
+            (2, 12, 10, 12, "left"),
+            (16, 22, 10, 12, "left"),
+            (16, 22, 8, 10, "right"),
+            (12, 14, 12, 22, "down"),
+            (14, 16, 12, 22, "up"),
+            (14, 16, 2, 8, "up"),
+            (12, 14, 2, 8, "down"),
+            # Glorieta
+            (13, 15, 8, 9, "right"),
+            (13, 15, 11, 12, "left"),
+            (12, 13, 9, 12, "down"),
+            (15, 16, 9, 12, "up"),
+        ],
+        intersections=[
+            # Glorieta
+            (12, 8, ["right", "down"]),
+            (12, 11, ["left", "down"]),
+            (15, 8, ["up", "right"]),
+            (15, 11, ["up", "left"]),
+            # Se usan para divagar por todo el mapa
+            (1, 9, ["down", "right"]),
+            (1, 8, ["down", "right"]),
+            (6, 7, ["right", "down"]),
+            (7, 7, ["right", "down"]),
+            (6, 5, ["left", "down"]),
+            (6, 4, ["left", "down"]),
+            (7, 5, ["right", "down"]),
+            (7, 4, ["right", "down"]),
+            (6, 11, ["left", "up"]),
+            (7, 11, ["left", "up"]),
+            (12, 17, ["left", "down"]),
+            (12, 18, ["left", "down"]),
+            (12, 22, ["left", "down"]),
+            (13, 22, ["left", "down"]),
+            (18, 1, ["right", "up"]),
+            (19, 1, ["right", "up"]),
+            (22, 16, ["left", "up"]),
+            (22, 17, ["left", "up"]),
+            (22, 10, ["left", "up"]),
+            (22, 11, ["left", "up"]),
+            (14, 1, ["right", "up"]),
+            (15, 1, ["right", "up"]),
+            (6, 8, ["right", "down"]),
+            (7, 8, ["right", "down"]),
+            (23, 17, ["left", "up"]),
+            (12, 23, ["left", "down"]),
+            (0, 8, ["right", "down"]),
+        ],
+        buildings=[
+            (2, 2, 4, 2),
+            (2, 6, 4, 2),
+            (8, 2, 4, 2),
+            (8, 6, 4, 2),
+            (2, 12, 4, 10),
+            (8, 12, 4, 5),
+            (8, 19, 4, 3),
+            (16, 2, 2, 6),
+            (20, 2, 2, 6),
+            (16, 12, 6, 4),
+            (16, 18, 6, 4),
+        ],
+        parkings=[
+            (3, 21, 2),
+            (5, 17, 6),
+            (2, 14, 1),
+            (4, 12, 4),
+            (4, 3, 5),
+            (3, 6, 3),
+            (9, 2, 8),
+            (10, 7, 11),
+            (8, 15, 7),
+            (10, 19, 9),
+            (10, 12, 10),
+            (17, 6, 13),
+            (17, 4, 14),
+            (20, 4, 17),
+            (20, 15, 16),
+            (20, 18, 15),
+            (17, 21, 12),
+        ],
+        traffic_lights=[
+            (5, 0, 2, 6, 2, 2),    # Semáforo izquierdo y su sidewalk
+            (2, 4, 2, 0, 6, 2),    # Semáforo inferior y su sidewalk
+            (8, 17, 2, 6, 16, 2),  # Semáforo central y su sidewalk
+            (8, 22, 2, 6, 21, 2),  # Semáforo derecho y su sidewalk
+            (17, 8, 2, 18, 7, 2),  # Semáforo derecho y su sidewalk
+        ],
+        roundabout=[(13, 9), (14, 9), (13, 10), (14, 10)],
+        # Prueba para ceder el paso
+        start_positions=[(0, 23), (23, 0), (23, 23), (0, 0), (7, 5), (12, 17), (13, 22), (18, 1), (22, 16)],
+        fleet={"normal": 2, "fast": 2, "slow": 2, "disobedient": 1, "dijkstra": 2},
+    )
+
+
+def _street_lines(size, block_size):
+    """Coordenadas del primer carril de cada calle a lo largo de un eje.
+
+    Siempre hay un número par de calles para que las direcciones alternadas
+    cierren el perímetro en un circuito.
+    """
+    count = max(2, (size - 2) // (block_size + 2) + 1)
+    if count % 2:
+        count += 1
+    lines = [round(i * (size - 2) / (count - 1)) for i in range(count)]
+    if any(b - a < 3 for a, b in zip(lines, lines[1:])):
+        raise ValueError(f"El mapa de {size} celdas es muy pequeño para calles con bloques de {block_size}")
+    return lines
+
+
+def generate_city(width=200, height=200, block_size=8, cars=1000, parkings_per_block=2,
+                  light_ratio=0.25, fleet_mix=None, seed=None):
+    """Ciudad en cuadrícula con calles de dos carriles y sentidos alternados.
+
+    Las manzanas son edificios con parkings_per_block estacionamientos en su
+    borde; las esquinas de cada cruce permiten seguir o dar vuelta, y una
+    fracción light_ratio de los cruces tiene semáforo con banqueta.
+    """
+    rng = random.Random(seed)
+    xs = _street_lines(width, block_size)
+    ys = _street_lines(height, block_size)
+    horizontal = {y: "right" if i % 2 == 0 else "left" for i, y in enumerate(ys)}
+    vertical = {x: "down" if i % 2 == 0 else "up" for i, x in enumerate(xs)}
+
+    streets = [(0, width, y, y + 2, direction) for y, direction in horizontal.items()]
+    streets += [(x, x + 2, 0, height, direction) for x, direction in vertical.items()]
+
+    # Cruces: cada celda permite las dos direcciones que no salen del mapa
+    intersections = []
+    offsets = {"right": (1, 0), "left": (-1, 0), "up": (0, 1), "down": (0, -1)}
+    for x, v_direction in vertical.items():
+        for y, h_direction in horizontal.items():
+            for cx in (x, x + 1):
+                for cy in (y, y + 1):
+                    directions = [
+                        direction for direction in (h_direction, v_direction)
+                        if 0 <= cx + offsets[direction][0] < width and 0 <= cy + offsets[direction][1] < height
+                    ]
+                    intersections.append((cx, cy, directions if len(directions) > 1 else directions[0]))
+
+    buildings = []
+    parkings = []
+    for x0, x1 in zip(xs, xs[1:]):
+        for y0, y1 in zip(ys, ys[1:]):
+            bx, by, bw, bh = x0 + 2, y0 + 2, x1 - x0 - 2, y1 - y0 - 2
+            buildings.append((bx, by, bw, bh))
+            border = sorted(
+                {(bx + i, by) for i in range(bw)} | {(bx + i, by + bh - 1) for i in range(bw)}
+                | {(bx, by + j) for j in range(bh)} | {(bx + bw - 1, by + j) for j in range(bh)}
+            )
+            for px, py in rng.sample(border, min(parkings_per_block, len(border))):
+                parkings.append((px, py, len(parkings) + 1))
+
+    # Semáforo sobre los dos carriles de la calle horizontal justo antes del
+    # cruce y banqueta sobre la calle vertical justo después
+    traffic_lights = []
+    for x in xs[1:-1]:
+        for y in ys[:-1]:
+            if rng.random() < light_ratio:
+                traffic_lights.append((x - 1, y, 2, x, y + 2, 2))
+
+    fleet_mix = fleet_mix or default_scenario().fleet
+    total = sum(fleet_mix.values())
+    fleet = {car_type: cars * count // total for car_type, count in fleet_mix.items()}
+    # Repartir el residuo de la división entre los primeros tipos
+    for car_type in list(fleet)[:cars - sum(fleet.values())]:
+        fleet[car_type] += 1
+
+    return Scenario(
+        width=width, height=height, streets=streets, intersections=intersections,
+        buildings=buildings, parkings=parkings, traffic_lights=traffic_lights,
+        start_positions=None, fleet=fleet,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un escenario de ciudad en cuadrícula")
+    parser.add_argument("--width", type=int, default=200)
+    parser.add_argument("--height", type=int, default=200)
+    parser.add_argument("--block-size", type=int, default=8)
+    parser.add_argument("--cars", type=int, default=1000)
+    parser.add_argument("--parkings-per-block", type=int, default=2)
+    parser.add_argument("--light-ratio", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-o", "--output", required=True, help="archivo JSON de salida")
+    args = parser.parse_args(argv)
+
+    scenario = generate_city(
+        args.width, args.height, block_size=args.block_size, cars=args.cars,
+        parkings_per_block=args.parkings_per_block, light_ratio=args.light_ratio, seed=args.seed,
+    )
+    scenario.save(args.output)
+
+
+if __name__ == '__main__':
+    main()
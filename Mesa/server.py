@@ -1,62 +1,310 @@
 # server.py
-from flask import Flask, jsonify
+#
+# Modelo de concurrencia: cada TrafficModel tiene un solo escritor. El modelo
+# global solo lo avanza el hilo de SimulationLoop y cada sesión solo se avanza
+# dentro de Session.step (serializado con su lock, desde el pool de
+# SessionManager). Después de cada tick el escritor publica un
+# PublishedSnapshot inmutable reemplazando una referencia; los handlers de
+# Flask nunca leen el modelo, solo el último snapshot publicado y el mapa
+# estático que se serializa antes de empezar a avanzar (/profile solo copia
+# los contadores del profiler). Así los lectores no
+# se bloquean entre sí ni bloquean al escritor.
+import argparse
+import logging
+import os
+import threading
+import time
+
+from flask import Flask, Response, abort, jsonify, request
 from flask_cors import CORS
 from model import TrafficModel
-from agents import (NormalCarAgent, FastCarAgent, SlowCarAgent, 
-                   DisobedientCarAgent, DijkstraCarAgent, TrafficLightAgent, SidewalkAgent)
+from sessions import SessionManager
+from snapshots import SnapshotHistory, StaticMap, build_snapshot
+
+log = logging.getLogger("traffic.server")
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# Crear una única instancia del modelo
-model = TrafficModel()
 
-def get_car_direction(pos):
-    """Obtiene la dirección del coche basada en su posición actual"""
-    direction = model.street_directions.get(pos)
-    if isinstance(direction, list):
-        return direction[0]
-    return direction
+class SimulationLoop:
+    """Avanza el modelo en su propio hilo a tick_rate pasos por segundo.
+
+    El hilo es el único que llama a model.step(); después de cada paso publica
+    un snapshot nuevo. Los endpoints solo leen el último snapshot publicado,
+    así que la velocidad de la simulación no depende de cuántos clientes
+    consultan ni de qué tan seguido lo hacen.
+    """
+
+    def __init__(self, model, tick_rate=2.0, keyframe_interval=50):
+        self.model = model
+        self.tick_rate = tick_rate
+        self.history = SnapshotHistory(keyframe_interval=keyframe_interval)
+        self.static_map = StaticMap(model)
+        self.snapshot = self.history.publish(build_snapshot(model))
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        # Avisa a los clientes de /stream cada vez que se publica un tick
+        self._published = threading.Condition()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="simulation-loop", daemon=True)
+            self._thread.start()
+
+    def wait_for_tick(self, after_tick, timeout=None):
+        """Espera a que se publique un tick distinto de after_tick; None si se agota timeout"""
+        with self._published:
+            published = self._published.wait_for(
+                lambda: self.snapshot.tick != after_tick or self._stop.is_set(), timeout
+            )
+        if not published or self.snapshot.tick == after_tick:
+            return None
+        return self.snapshot
+
+    def stop(self):
+        self._stop.set()
+        with self._published:
+            self._published.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        interval = 1.0 / self.tick_rate
+        next_tick = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self.model.step()
+            except Exception:
+                log.exception("Error al avanzar la simulación; se detiene el ciclo")
+                return
+            # Reemplazar la referencia de una vez: los lectores ven el snapshot anterior o el nuevo
+            with self.model.profiler.phase("snapshot"):
+                self.snapshot = self.history.publish(build_snapshot(self.model))
+            with self._published:
+                self._published.notify_all()
+
+            next_tick += interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # Si la simulación va atrasada no intentar recuperar los ticks perdidos
+                next_tick = time.perf_counter()
+
+
+def parse_tick_rate(value):
+    """Pasos por segundo del ciclo global; con 0 o menos el hilo no podría avanzar"""
+    tick_rate = float(value)
+    if tick_rate <= 0:
+        raise ValueError(f"El ritmo de la simulación debe ser mayor que 0: {value}")
+    return tick_rate
+
+
+# Crear una única instancia del modelo y su ciclo de simulación
+# (SIM_PROFILE=1 activa los tiempos por fase que reporta /profile)
+model = TrafficModel(profile=os.environ.get("SIM_PROFILE") == "1")
+simulation = SimulationLoop(model, tick_rate=parse_tick_rate(os.environ.get("SIM_TICK_RATE", 2.0)))
+
+# Simulaciones independientes creadas por los clientes en /sessions
+sessions = SessionManager(
+    max_workers=int(os.environ.get("SIM_SESSION_WORKERS", 4)),
+    idle_timeout=float(os.environ.get("SIM_SESSION_IDLE_TIMEOUT", 600)),
+    max_sessions=int(os.environ.get("SIM_MAX_SESSIONS", 32)),
+)
+# Una sola petición a /step no puede ocupar un hilo del pool (y el lock de la sesión) indefinidamente
+MAX_STEPS_PER_REQUEST = int(os.environ.get("SIM_MAX_STEPS_PER_REQUEST", 1000))
+
+
+@app.before_request
+def start_simulation():
+    simulation.start()
+    sessions.start()
+
+
+def map_response(static_map):
+    response = Response(static_map.encoded, mimetype="application/json")
+    response.set_etag(static_map.etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def profile_response(profiler):
+    if not profiler.enabled:
+        abort(404, description="El perfilado no está activado")
+    return jsonify({"data": profiler.report()})
+
+
+def state_response(history, snapshot):
+    since = request.args.get("since", type=int)
+    if since is None:
+        return Response(snapshot.encoded(), mimetype="application/json")
+    return Response(history.encoded_since(since, snapshot), mimetype="application/json")
+
+
+@app.route('/map')
+def get_map():
+    """Calles, edificios, estacionamientos, glorieta, semáforos y banquetas.
+
+    No cambia mientras corre la simulación: el cliente lo descarga una vez y
+    después revalida con If-None-Match (respuesta 304 sin cuerpo).
+    """
+    return map_response(simulation.static_map)
 
 @app.route('/positions/cars')
 def get_car_positions():
-    model.step()  # Avanza un paso
-    car_data = []
-    for agent in model.schedule.agents:
-        if isinstance(agent, (NormalCarAgent, FastCarAgent, SlowCarAgent, 
-                           DisobedientCarAgent, DijkstraCarAgent)):
-            car_data.append({
-                "id": agent.unique_id,
-                "type": agent.__class__.__name__,
-                "position": agent.pos,
-                "state": agent.estado,
-                "direction": get_car_direction(agent.pos)
-            })
-    return jsonify({"data": car_data})
+    """JSON por defecto; con "Accept: application/octet-stream" devuelve el formato
+    binario de registros fijos descrito en snapshots.py"""
+    snapshot = simulation.snapshot
+    best = request.accept_mimetypes.best_match(["application/json", "application/octet-stream"])
+    if best == "application/octet-stream":
+        response = Response(snapshot.encoded_cars_binary(), mimetype="application/octet-stream")
+    else:
+        response = Response(snapshot.encoded_list("cars"), mimetype="application/json")
+    response.vary.add("Accept")
+    return response
 
 @app.route('/positions/traffic_lights')
 def get_traffic_light_positions():
-    traffic_light_data = []
-    for agent in model.schedule.agents:
-        if isinstance(agent, TrafficLightAgent):
-            traffic_light_data.append({
-                "id": agent.unique_id,
-                "position": agent.pos,
-                "state": agent.state
-            })
-    return jsonify({"data": traffic_light_data})
+    return Response(simulation.snapshot.encoded_list("traffic_lights"), mimetype="application/json")
 
 @app.route('/positions/sidewalks')
 def get_sidewalk_positions():
-    sidewalk_data = []
-    for agent in model.schedule.agents:
-        if isinstance(agent, SidewalkAgent):
-            sidewalk_data.append({
-                "id": agent.unique_id,
-                "position": agent.pos,
-                "state": agent.state()
-            })
-    return jsonify({"data": sidewalk_data})
+    return Response(simulation.snapshot.encoded_list("sidewalks"), mimetype="application/json")
+
+@app.route('/state')
+def get_state():
+    """Coches, semáforos y banquetas del mismo tick en una sola respuesta.
+
+    Con ?since=<tick> solo se envían las entidades que cambiaron después de ese
+    tick (más los ids eliminados), o un keyframe completo si hace falta.
+    """
+    return state_response(simulation.history, simulation.snapshot)
+
+@app.route('/profile')
+def get_profile():
+    """Tiempos por fase del modelo global (con SIM_PROFILE=1)"""
+    return profile_response(model.profiler)
+
+@app.route('/stream')
+def stream_state():
+    """Server-Sent Events: un evento "tick" por cada paso publicado.
+
+    mode=delta (por defecto) envía un keyframe y después solo los cambios;
+    mode=full envía el snapshot completo en cada tick. Al reconectar, el
+    navegador manda Last-Event-ID y el flujo continúa desde ese tick.
+    """
+    mode = request.args.get("mode", "delta")
+    last_tick = request.headers.get("Last-Event-ID", type=int)
+
+    def events():
+        nonlocal last_tick
+        while True:
+            if last_tick is None:
+                snapshot = simulation.snapshot
+            else:
+                snapshot = simulation.wait_for_tick(last_tick, timeout=15)
+            if snapshot is None:
+                # Mantener viva la conexión mientras no hay ticks nuevos
+                yield b": keepalive\n\n"
+                continue
+            if mode == "full":
+                payload = snapshot.encoded()
+            else:
+                payload = simulation.history.encoded_since(last_tick, snapshot)
+            last_tick = snapshot.tick
+            yield b"id: %d\nevent: tick\ndata: %s\n\n" % (snapshot.tick, payload)
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def get_session_or_404(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        abort(404, description=f"Sesión {session_id} no encontrada")
+    return session
+
+@app.route('/sessions', methods=['GET'])
+def list_sessions():
+    return jsonify({"data": sessions.describe_all()})
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """Crea una simulación independiente.
+
+    Cuerpo JSON opcional: width, height, seed, precompute_routes, engine,
+    step_mode, profile y tick_rate (pasos por segundo para que avance sola; 0 = solo
+    con /step).
+    """
+    params = request.get_json(silent=True) or {}
+    if not isinstance(params, dict):
+        abort(400, description="El cuerpo debe ser un objeto JSON")
+    try:
+        tick_rate = float(params.pop("tick_rate", 0.0))
+        session = sessions.create(tick_rate=tick_rate, **params)
+    except (TypeError, ValueError) as error:
+        abort(400, description=str(error))
+    except RuntimeError as error:
+        abort(503, description=str(error))
+    return jsonify(session.describe()), 201
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def describe_session(session_id):
+    return jsonify(get_session_or_404(session_id).describe())
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.delete(session_id):
+        abort(404, description=f"Sesión {session_id} no encontrada")
+    return "", 204
+
+@app.route('/sessions/<session_id>/step', methods=['POST'])
+def step_session(session_id):
+    session = get_session_or_404(session_id)
+    steps = request.args.get("steps", default=1, type=int)
+    if not 1 <= steps <= MAX_STEPS_PER_REQUEST:
+        abort(400, description=f"steps debe estar entre 1 y {MAX_STEPS_PER_REQUEST}")
+    snapshot = sessions.step(session, steps)
+    return jsonify({"id": session.id, "tick": snapshot.tick})
+
+@app.route('/sessions/<session_id>/run', methods=['POST'])
+def run_session(session_id):
+    """Cambia cuántos pasos por segundo avanza la sesión sola (0 la detiene)"""
+    session = get_session_or_404(session_id)
+    params = request.get_json(silent=True) or {}
+    if not isinstance(params, dict):
+        abort(400, description="El cuerpo debe ser un objeto JSON")
+    try:
+        tick_rate = float(params.get("tick_rate", 0.0))
+    except (TypeError, ValueError) as error:
+        abort(400, description=str(error))
+    sessions.set_tick_rate(session, tick_rate)
+    return jsonify(session.describe())
+
+@app.route('/sessions/<session_id>/state')
+def get_session_state(session_id):
+    session = get_session_or_404(session_id)
+    return state_response(session.history, session.snapshot)
+
+@app.route('/sessions/<session_id>/profile')
+def get_session_profile(session_id):
+    """Tiempos por fase de una sesión creada con "profile": true"""
+    return profile_response(get_session_or_404(session_id).model.profiler)
+
+@app.route('/sessions/<session_id>/map')
+def get_session_map(session_id):
+    return map_response(get_session_or_404(session_id).static_map)
 
 if __name__ == '__main__':
-    app.run(port=5000, debug=False)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Servidor de la simulación de tráfico")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--tick-rate", type=float, default=simulation.tick_rate,
+                        help="pasos de simulación por segundo")
+    args = parser.parse_args()
+    if args.tick_rate <= 0:
+        parser.error("--tick-rate debe ser mayor que 0")
+    simulation.tick_rate = args.tick_rate
+    simulation.start()
+    app.run(port=args.port, debug=False, threaded=True)
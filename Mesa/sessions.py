@@ -0,0 +1,205 @@
+# sessions.py
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from model import TrafficModel
+from scenario import default_scenario
+from snapshots import SnapshotHistory, StaticMap, build_snapshot
+
+log = logging.getLogger("traffic.sessions")
+
+# Parámetros de TrafficModel que un cliente puede elegir al crear una sesión
+SESSION_MODEL_PARAMS = ("width", "height", "seed", "precompute_routes", "engine", "step_mode", "profile")
+
+
+class Session:
+    """Un TrafficModel independiente con su historial de snapshots.
+
+    Solo se avanza dentro de step(), protegido por lock, así que una sesión
+    nunca se avanza dos veces a la vez aunque varios clientes lo pidan. Los
+    lectores usan únicamente snapshot y static_map, nunca el modelo.
+    """
+
+    def __init__(self, session_id, model_kwargs, tick_rate=0.0):
+        self.id = session_id
+        self.model_kwargs = model_kwargs
+        self.model = TrafficModel(**model_kwargs)
+        self.history = SnapshotHistory()
+        self.snapshot = self.history.publish(build_snapshot(self.model))
+        # Serializar el mapa antes de que cualquier hilo pueda avanzar el modelo
+        self.static_map = StaticMap(self.model)
+        self.lock = threading.Lock()
+        self.tick_rate = tick_rate
+        self.next_tick = time.monotonic()
+        self.stepping = False
+        self.last_access = time.monotonic()
+
+    def touch(self):
+        self.last_access = time.monotonic()
+
+    def step(self, steps=1):
+        with self.lock:
+            for _ in range(steps):
+                self.model.step()
+                with self.model.profiler.phase("snapshot"):
+                    self.snapshot = self.history.publish(build_snapshot(self.model))
+        return self.snapshot
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "tick": self.snapshot.tick,
+            "tick_rate": self.tick_rate,
+            "params": self.model_kwargs,
+            "idle_seconds": round(time.monotonic() - self.last_access, 3),
+        }
+
+
+class SessionManager:
+    """Aloja varias sesiones y las avanza con un pool de hilos.
+
+    Las sesiones con tick_rate > 0 se avanzan solas desde un hilo planificador
+    que reparte los pasos pendientes en el pool. Las sesiones sin actividad
+    durante idle_timeout segundos se eliminan.
+
+    Son hilos, no procesos: el modelo se queda en el servidor para servir sus
+    snapshots, pero por el GIL los pasos en Python puro de distintas sesiones
+    se intercalan en lugar de correr al mismo tiempo.
+    """
+
+    def __init__(self, max_workers=4, idle_timeout=600.0, max_sessions=32):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        # Sesiones que se están construyendo; ya cuentan para max_sessions
+        self._reserved = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="session-worker")
+        self._stop = threading.Event()
+        # Despierta al planificador cuando cambia el ritmo de alguna sesión
+        self._wakeup = threading.Event()
+        self._scheduler = None
+
+    def start(self):
+        with self._lock:
+            if self._scheduler is not None:
+                return
+            self._scheduler = threading.Thread(target=self._run, name="session-scheduler", daemon=True)
+            self._scheduler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._scheduler is not None:
+            self._scheduler.join()
+        self._pool.shutdown(wait=True)
+
+    def create(self, tick_rate=0.0, **model_kwargs):
+        unknown = set(model_kwargs) - set(SESSION_MODEL_PARAMS)
+        if unknown:
+            raise ValueError(f"Parámetros no permitidos: {', '.join(sorted(unknown))}")
+        # El mapa de las sesiones es el escenario por defecto; el grid no puede ser más chico
+        scenario = default_scenario()
+        for name, minimum in (("width", scenario.width), ("height", scenario.height)):
+            value = model_kwargs.get(name)
+            if value is not None and (type(value) is not int or value < minimum):
+                raise ValueError(f"{name} debe ser un entero de al menos {minimum}")
+        # Reservar el lugar antes de construir el modelo (fuera del lock) para que
+        # peticiones simultáneas no pasen de max_sessions
+        with self._lock:
+            if len(self.sessions) + self._reserved >= self.max_sessions:
+                raise RuntimeError("Se alcanzó el número máximo de sesiones")
+            self._reserved += 1
+        session = None
+        try:
+            session = Session(uuid.uuid4().hex, model_kwargs, tick_rate)
+        finally:
+            with self._lock:
+                self._reserved -= 1
+                if session is not None:
+                    self.sessions[session.id] = session
+        self._wakeup.set()
+        return session
+
+    def set_tick_rate(self, session, tick_rate):
+        """Pasos por segundo con los que la sesión avanza sola (0 la detiene)"""
+        session.tick_rate = max(tick_rate, 0.0)
+        session.next_tick = time.monotonic()
+        self._wakeup.set()
+
+    def get(self, session_id):
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is not None:
+            session.touch()
+        return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def _snapshot_sessions(self):
+        with self._lock:
+            return list(self.sessions.values())
+
+    def describe_all(self):
+        return [session.describe() for session in self._snapshot_sessions()]
+
+    def step(self, session, steps=1):
+        """Avanza una sesión en el pool y espera el resultado"""
+        return self._pool.submit(session.step, steps).result()
+
+    def step_all(self, steps=1):
+        """Avanza todas las sesiones en el pool (intercaladas por el GIL); devuelve {id: tick}"""
+        sessions = self._snapshot_sessions()
+        futures = [self._pool.submit(session.step, steps) for session in sessions]
+        return {session.id: future.result().tick for session, future in zip(sessions, futures)}
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                session_id for session_id, session in self.sessions.items()
+                if now - session.last_access > self.idle_timeout
+            ]
+            for session_id in expired:
+                del self.sessions[session_id]
+        for session_id in expired:
+            log.info("Sesión %s eliminada por inactividad", session_id)
+        return expired
+
+    def _step_scheduled(self, session):
+        try:
+            session.step()
+        except Exception:
+            log.exception("Error al avanzar la sesión %s; se detiene", session.id)
+            session.tick_rate = 0.0
+        finally:
+            session.stepping = False
+
+    def _run(self):
+        next_eviction = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            wait = 0.5
+            for session in self._snapshot_sessions():
+                if session.tick_rate <= 0:
+                    continue
+                if session.next_tick <= now and not session.stepping:
+                    session.stepping = True
+                    session.next_tick = max(session.next_tick + 1.0 / session.tick_rate, now)
+                    try:
+                        self._pool.submit(self._step_scheduled, session)
+                    except RuntimeError:
+                        # El pool ya se cerró (stop() o fin del intérprete)
+                        return
+                wait = min(wait, max(session.next_tick - now, 0.001))
+            # Revisar sesiones inactivas cada 5 segundos
+            if now >= next_eviction:
+                self.evict_idle()
+                next_eviction = now + 5.0
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
@@ -0,0 +1,86 @@
+# simlog.py
+"""Registro de la simulación: logging por niveles y traza binaria de eventos.
+
+Los agentes registran con logging.getLogger("traffic.*").debug(...) usando
+argumentos %s, así que con el nivel por defecto (WARNING) el mensaje nunca se
+formatea. configure_logging() activa la salida cuando se necesita depurar.
+
+EventTrace guarda eventos como registros de enteros de tamaño fijo
+(step, id del agente, código de evento, x, y) en memoria y los escribe a disco
+para analizarlos después con load_trace().
+"""
+import logging
+import sys
+from array import array
+
+import numpy as np
+
+logging.getLogger("traffic").addHandler(logging.NullHandler())
+
+# Códigos de evento de la traza
+MOVE = 1
+PARK = 2
+BLOCKED = 3
+LANE_CHANGE = 4
+ROUTE = 5
+NO_ROUTE = 6
+IGNORE_LIGHT = 7
+
+EVENT_NAMES = {
+    MOVE: "move",
+    PARK: "park",
+    BLOCKED: "blocked",
+    LANE_CHANGE: "lane_change",
+    ROUTE: "route",
+    NO_ROUTE: "no_route",
+    IGNORE_LIGHT: "ignore_light",
+}
+
+TRACE_DTYPE = np.dtype([
+    ("step", "<i4"), ("agent", "<i4"), ("event", "<i4"), ("x", "<i4"), ("y", "<i4"),
+])
+
+
+def configure_logging(level="DEBUG", stream=None):
+    """Muestra los mensajes de la simulación a partir de level (por defecto todos)"""
+    logger = logging.getLogger("traffic")
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return logger
+
+
+class EventTrace:
+    """Traza binaria de eventos de los agentes"""
+
+    def __init__(self):
+        self._records = array("i")
+
+    def __len__(self):
+        return len(self._records) // len(TRACE_DTYPE.names)
+
+    def record(self, step, agent_id, event, pos):
+        self._records.extend((step, agent_id, event, pos[0], pos[1]))
+
+    def record_many(self, step, agent_ids, event, xs, ys):
+        """Agrega un evento por cada agente de agent_ids (arreglos del mismo tamaño)"""
+        records = np.empty(len(agent_ids), dtype=TRACE_DTYPE)
+        records["step"] = step
+        records["agent"] = agent_ids
+        records["event"] = event
+        records["x"] = xs
+        records["y"] = ys
+        self._records.frombytes(records.tobytes())
+
+    def to_array(self):
+        return np.frombuffer(self._records.tobytes(), dtype=TRACE_DTYPE)
+
+    def save(self, path):
+        with open(path, "wb") as trace_file:
+            trace_file.write(self.to_array().tobytes())
+
+
+def load_trace(path):
+    """Lee una traza guardada con EventTrace.save como arreglo estructurado de NumPy"""
+    return np.fromfile(path, dtype=TRACE_DTYPE)
@@ -0,0 +1,289 @@
+# snapshots.py
+import hashlib
+import json
+import struct
+import threading
+from collections import deque
+
+import numpy as np
+
+from agents import BuildingAgent, ParkingAgent, RoundaboutAgent, TrafficLightAgent
+
+
+def car_direction(model, pos):
+    """Obtiene la dirección del coche basada en su posición actual"""
+    direction = model.street_directions.get(pos)
+    if isinstance(direction, list):
+        return direction[0]
+    return direction
+
+
+def build_snapshot(model):
+    """Estado dinámico del modelo en el tick actual"""
+    cars = []
+    for agent in model.car_agents():
+        cars.append({
+            "id": agent.unique_id,
+            "type": agent.__class__.__name__,
+            "position": agent.pos,
+            "state": agent.estado,
+            "direction": car_direction(model, agent.pos)
+        })
+
+    traffic_lights = []
+    for agent in model.schedule.agents:
+        if not isinstance(agent, TrafficLightAgent):
+            continue
+        traffic_lights.append({
+            "id": agent.unique_id,
+            "position": agent.pos,
+            "state": agent.state
+        })
+
+    sidewalks = []
+    for traffic_light in model.traffic_lights:
+        for agent in traffic_light.sidewalks:
+            sidewalks.append({
+                "id": agent.unique_id,
+                "position": agent.pos,
+                "state": agent.state()
+            })
+
+    return {
+        "tick": model.schedule.steps,
+        "cars": cars,
+        "traffic_lights": traffic_lights,
+        "sidewalks": sidewalks,
+    }
+
+
+def build_static_map(model):
+    """Elementos del mapa que no cambian después de TrafficModel.__init__"""
+    buildings = []
+    roundabout = []
+    parkings = []
+    for agent in model.static_agents:
+        if isinstance(agent, BuildingAgent):
+            buildings.append(agent.pos)
+        elif isinstance(agent, RoundaboutAgent):
+            roundabout.append(agent.pos)
+        elif isinstance(agent, ParkingAgent):
+            parkings.append({"id": agent.unique_id, "number": agent.number, "position": agent.pos})
+
+    traffic_lights = []
+    sidewalks = []
+    for traffic_light in model.traffic_lights:
+        traffic_lights.append({"id": traffic_light.unique_id, "cells": traffic_light.cells})
+        for sidewalk in traffic_light.sidewalks:
+            sidewalks.append({
+                "id": sidewalk.unique_id,
+                "position": sidewalk.pos,
+                "traffic_light": traffic_light.unique_id
+            })
+
+    streets = [
+        [x, y, direction] for (x, y), direction in model.street_directions.items()
+    ]
+
+    return {
+        "width": model.grid.width,
+        "height": model.grid.height,
+        "streets": streets,
+        "buildings": buildings,
+        "roundabout": roundabout,
+        "parkings": parkings,
+        "traffic_lights": traffic_lights,
+        "sidewalks": sidewalks,
+    }
+
+
+class StaticMap:
+    """Mapa estático serializado una sola vez, con su ETag"""
+
+    def __init__(self, model):
+        self.data = build_static_map(model)
+        self.encoded = json.dumps(self.data, separators=(",", ":")).encode()
+        self.etag = hashlib.sha1(self.encoded).hexdigest()
+
+
+ENTITY_KINDS = ("cars", "traffic_lights", "sidewalks")
+
+# Formato binario de posiciones de coches (little-endian):
+#   encabezado de 12 bytes: b"CARS", tick (uint32), número de registros (uint32)
+#   seguido de un registro de 12 bytes por coche con CAR_RECORD_DTYPE
+CARS_MAGIC = b"CARS"
+CARS_HEADER = struct.Struct("<4sII")
+CAR_RECORD_DTYPE = np.dtype([
+    ("id", "<u4"), ("type", "u1"), ("state", "u1"), ("direction", "u1"), ("reserved", "u1"),
+    ("x", "<i2"), ("y", "<i2"),
+])
+CAR_TYPE_CODES = {
+    "NormalCarAgent": 0,
+    "DijkstraCarAgent": 1,
+    "FastCarAgent": 2,
+    "SlowCarAgent": 3,
+    "DisobedientCarAgent": 4,
+}
+STATE_CODES = {"tranquilo": 0, "enojado": 1}
+DIRECTION_CODES = {None: 0, "right": 1, "left": 2, "up": 3, "down": 4}
+
+
+def encode_cars_binary(data):
+    """Codifica los coches de un snapshot como registros de tamaño fijo"""
+    cars = data["cars"]
+    records = np.zeros(len(cars), dtype=CAR_RECORD_DTYPE)
+    records["id"] = [car["id"] for car in cars]
+    records["type"] = [CAR_TYPE_CODES[car["type"]] for car in cars]
+    records["state"] = [STATE_CODES[car["state"]] for car in cars]
+    records["direction"] = [DIRECTION_CODES[car["direction"]] for car in cars]
+    records["x"] = [car["position"][0] for car in cars]
+    records["y"] = [car["position"][1] for car in cars]
+    return CARS_HEADER.pack(CARS_MAGIC, data["tick"], len(cars)) + records.tobytes()
+
+
+def decode_cars_binary(payload):
+    """Inverso de encode_cars_binary: devuelve (tick, arreglo estructurado)"""
+    magic, tick, count = CARS_HEADER.unpack_from(payload)
+    if magic != CARS_MAGIC:
+        raise ValueError("No es un bloque binario de coches")
+    records = np.frombuffer(payload, dtype=CAR_RECORD_DTYPE, count=count, offset=CARS_HEADER.size)
+    return tick, records
+
+
+def diff_snapshots(previous, current):
+    """Entidades que aparecieron o cambiaron entre dos snapshots, y los ids que desaparecieron"""
+    delta = {"removed": {}}
+    for kind in ENTITY_KINDS:
+        before = {entity["id"]: entity for entity in previous[kind]}
+        delta[kind] = [entity for entity in current[kind] if before.pop(entity["id"], None) != entity]
+        delta["removed"][kind] = list(before)
+    return delta
+
+
+def merge_deltas(deltas):
+    """Combina deltas consecutivos (del más viejo al más nuevo) en uno solo"""
+    changed = {kind: {} for kind in ENTITY_KINDS}
+    removed = {kind: set() for kind in ENTITY_KINDS}
+    for delta in deltas:
+        for kind in ENTITY_KINDS:
+            for entity in delta[kind]:
+                changed[kind][entity["id"]] = entity
+                removed[kind].discard(entity["id"])
+            for entity_id in delta["removed"][kind]:
+                changed[kind].pop(entity_id, None)
+                removed[kind].add(entity_id)
+    merged = {kind: list(changed[kind].values()) for kind in ENTITY_KINDS}
+    merged["removed"] = {kind: sorted(removed[kind]) for kind in ENTITY_KINDS}
+    return merged
+
+
+class PublishedSnapshot:
+    """Snapshot de un tick junto con su JSON, que se codifica una sola vez
+    sin importar cuántos clientes lo pidan. delta guarda los cambios respecto
+    al tick anterior (None si no hay tick anterior).
+
+    Una vez publicado no se modifica: el hilo que avanza el modelo crea uno
+    nuevo por tick y solo reemplaza la referencia, así que los lectores pueden
+    usarlo sin bloqueo. Las codificaciones se calculan la primera vez que se
+    piden; si dos lectores lo hacen a la vez ambos obtienen los mismos bytes.
+    """
+
+    def __init__(self, data, delta=None, keyframe=True):
+        self.data = data
+        self.tick = data["tick"]
+        self.delta = delta
+        self.keyframe = keyframe
+        self._encoded = None
+        self._encoded_delta = None
+        self._encoded_cars_binary = None
+        self._encoded_lists = {}
+
+    def encoded(self):
+        if self._encoded is None:
+            self._encoded = json.dumps(self.data, separators=(",", ":")).encode()
+        return self._encoded
+
+    def encoded_list(self, kind):
+        """{"data": [...]} de un tipo de entidad, como lo devuelven /positions/*"""
+        encoded = self._encoded_lists.get(kind)
+        if encoded is None:
+            encoded = json.dumps({"data": self.data[kind]}, separators=(",", ":")).encode()
+            self._encoded_lists[kind] = encoded
+        return encoded
+
+    def encoded_cars_binary(self):
+        if self._encoded_cars_binary is None:
+            self._encoded_cars_binary = encode_cars_binary(self.data)
+        return self._encoded_cars_binary
+
+    def encoded_delta(self):
+        """Respuesta delta para clientes que ya tienen el tick anterior"""
+        if self._encoded_delta is None:
+            self._encoded_delta = encode_delta(self.tick, self.tick - 1, self.delta)
+        return self._encoded_delta
+
+
+def encode_delta(tick, since, delta):
+    response = {"tick": tick, "since": since, "keyframe": False}
+    response.update(delta)
+    return json.dumps(response, separators=(",", ":")).encode()
+
+
+def encode_keyframe(snapshot):
+    response = {"keyframe": True}
+    response.update(snapshot.data)
+    return json.dumps(response, separators=(",", ":")).encode()
+
+
+class SnapshotHistory:
+    """Últimos snapshots publicados, para responder deltas desde un tick dado.
+
+    Cada keyframe_interval ticks se marca un keyframe: un cliente cuyo último tick
+    es anterior al keyframe más reciente (o ya salió de la ventana de historial)
+    recibe el estado completo en lugar de un delta, lo que corrige cualquier
+    desincronización acumulada.
+    """
+
+    def __init__(self, keyframe_interval=50, max_ticks=200):
+        self.keyframe_interval = keyframe_interval
+        self._entries = deque(maxlen=max_ticks)
+        self._lock = threading.Lock()
+        self.last_keyframe_tick = None
+
+    def publish(self, data):
+        with self._lock:
+            previous = self._entries[-1] if self._entries else None
+            delta = diff_snapshots(previous.data, data) if previous is not None else None
+            keyframe = (
+                previous is None
+                or data["tick"] - self.last_keyframe_tick >= self.keyframe_interval
+            )
+            snapshot = PublishedSnapshot(data, delta, keyframe)
+            if keyframe:
+                self.last_keyframe_tick = snapshot.tick
+            self._entries.append(snapshot)
+            return snapshot
+
+    @property
+    def latest(self):
+        return self._entries[-1]
+
+    def encoded_since(self, since, latest=None):
+        """JSON con lo que cambió después del tick since hasta latest (por defecto el
+        último publicado), o un keyframe si no es posible"""
+        with self._lock:
+            entries = list(self._entries)
+            last_keyframe_tick = self.last_keyframe_tick
+        if latest is None:
+            latest = entries[-1]
+        else:
+            entries = [entry for entry in entries if entry.tick <= latest.tick]
+            if last_keyframe_tick > latest.tick:
+                return encode_keyframe(latest)
+        oldest = entries[0].tick
+        if since is None or since < last_keyframe_tick or since < oldest or since > latest.tick:
+            return encode_keyframe(latest)
+        if since == latest.tick - 1:
+            return latest.encoded_delta()
+        deltas = [entry.delta for entry in entries if entry.tick > since]
+        return encode_delta(latest.tick, since, merge_deltas(deltas))
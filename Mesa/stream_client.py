@@ -0,0 +1,94 @@
+# stream_client.py
+"""Cliente de prueba para el flujo /stream (Server-Sent Events).
+
+Reconstruye el estado a partir de keyframes y deltas e imprime un resumen por
+tick. Con --local levanta el servidor Flask en este mismo proceso en un puerto
+libre, así que se puede verificar sin Unity ni red.
+
+Uso:
+    python stream_client.py --local --count 20
+    python stream_client.py --url http://localhost:5000/stream --mode full
+"""
+import argparse
+import json
+import threading
+import urllib.request
+
+from snapshots import ENTITY_KINDS
+
+
+def read_events(response):
+    """Genera (id, event, data) por cada evento SSE de la respuesta"""
+    event_id, event, data = None, None, []
+    for raw_line in response:
+        line = raw_line.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data:
+                yield event_id, event, "\n".join(data)
+            event_id, event, data = None, None, []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "id":
+            event_id = value
+        elif field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+
+
+def apply_message(state, message):
+    """Aplica un keyframe o un delta al estado reconstruido {tipo: {id: entidad}}"""
+    if message.get("keyframe", True):
+        for kind in ENTITY_KINDS:
+            state[kind] = {entity["id"]: entity for entity in message[kind]}
+        return
+    for kind in ENTITY_KINDS:
+        for entity in message[kind]:
+            state[kind][entity["id"]] = entity
+        for entity_id in message["removed"][kind]:
+            state[kind].pop(entity_id, None)
+
+
+def start_local_server():
+    """Levanta la app de server.py en un hilo y devuelve la URL de /stream"""
+    from werkzeug.serving import make_server
+    import server
+
+    http_server = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    server.simulation.start()
+    return f"http://127.0.0.1:{http_server.server_port}/stream"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cliente de prueba del flujo de ticks")
+    parser.add_argument("--url", default="http://localhost:5000/stream")
+    parser.add_argument("--mode", choices=["delta", "full"], default="delta")
+    parser.add_argument("--count", type=int, default=10, help="número de ticks a recibir")
+    parser.add_argument("--local", action="store_true", help="levantar el servidor en este proceso")
+    args = parser.parse_args(argv)
+
+    url = start_local_server() if args.local else args.url
+    state = {kind: {} for kind in ENTITY_KINDS}
+    received = 0
+    with urllib.request.urlopen(f"{url}?mode={args.mode}", timeout=30) as response:
+        for event_id, event, data in read_events(response):
+            if event != "tick":
+                continue
+            message = json.loads(data)
+            apply_message(state, message)
+            print(
+                f"tick {event_id}: {'keyframe' if message.get('keyframe', True) else 'delta'} "
+                f"{len(data)} bytes, {len(message['cars'])} coches en el mensaje, "
+                f"{len(state['cars'])} coches en total"
+            )
+            received += 1
+            if received >= args.count:
+                break
+
+
+if __name__ == '__main__':
+    main()
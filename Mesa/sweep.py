@@ -0,0 +1,166 @@
+# sweep.py
+"""Barridos Monte Carlo: muchas corridas independientes de TrafficModel en paralelo.
+
+Cada combinación de parámetros de la cuadrícula se corre con cada semilla en
+un pool de procesos. Las métricas de cada corrida (las de runner.run) llegan
+conforme terminan y al final se agregan por combinación.
+
+Parámetros que se pueden barrer: los de TrafficModel en SWEEP_MODEL_PARAMS,
+"scenario" (archivo JSON) y "fleet" (cambios a la flota del escenario, p. ej.
+{"fast": 4}).
+
+Uso:
+    python sweep.py --grid '{"light_interval": [5, 10, 20], "fleet": [{"fast": 2}, {"fast": 6}]}' \\
+        --seeds 50 --steps 500 --out runs.jsonl
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from runner import run
+from scenario import Scenario, default_scenario
+
+SWEEP_MODEL_PARAMS = (
+    "width", "height", "precompute_routes", "engine", "step_mode", "light_interval", "detection_radius",
+)
+SWEEP_PARAMS = SWEEP_MODEL_PARAMS + ("scenario", "fleet")
+
+
+def expand_grid(grid):
+    """{"param": [valores]} -> lista de combinaciones {"param": valor}, en orden"""
+    unknown = set(grid) - set(SWEEP_PARAMS)
+    if unknown:
+        raise ValueError(f"Parámetros no permitidos: {', '.join(sorted(unknown))}")
+    names = list(grid)
+    values = [grid[name] if isinstance(grid[name], list) else [grid[name]] for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def build_scenario(params):
+    if "scenario" not in params and "fleet" not in params:
+        return None
+    scenario = Scenario.load(params["scenario"]) if "scenario" in params else default_scenario()
+    if "fleet" in params:
+        data = scenario.to_dict()
+        data["fleet"] = dict(scenario.fleet, **params["fleet"])
+        scenario = Scenario.from_dict(data)
+    return scenario
+
+
+def run_one(params, seed, steps):
+    """Una corrida; se ejecuta en un proceso del pool. Los errores se devuelven
+    en el resultado para no detener el barrido completo."""
+    result = {"params": params, "seed": seed}
+    try:
+        model_kwargs = {name: params[name] for name in SWEEP_MODEL_PARAMS if name in params}
+        _, result["metrics"] = run(steps=steps, seed=seed, scenario=build_scenario(params), **model_kwargs)
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    return result
+
+
+def sweep(grid, seeds=range(10), steps=500, workers=None):
+    """Genera el resultado de cada corrida (combinación x semilla) conforme termina.
+
+    workers=1 corre todo en este proceso, sin pool.
+    """
+    combinations = expand_grid(grid)
+    tasks = [(params, seed) for params in combinations for seed in seeds]
+    if workers == 1:
+        for params, seed in tasks:
+            yield run_one(params, seed, steps)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, params, seed, steps) for params, seed in tasks]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Si el consumidor deja de leer, no correr lo que falta
+            for future in futures:
+                future.cancel()
+
+
+def aggregate(results):
+    """Media, desviación estándar, mínimo y máximo de cada métrica por combinación"""
+    groups = {}
+    for result in results:
+        key = json.dumps(result["params"], sort_keys=True)
+        group = groups.setdefault(key, {"params": result["params"], "runs": 0, "errors": 0, "values": {}})
+        if "error" in result:
+            group["errors"] += 1
+            continue
+        group["runs"] += 1
+        for name, value in result["metrics"].items():
+            group["values"].setdefault(name, []).append(value)
+
+    summary = []
+    for _, group in sorted(groups.items()):
+        metrics = {}
+        for name, values in group.pop("values").items():
+            values = np.asarray(values, dtype=float)
+            metrics[name] = {
+                "mean": float(values.mean()),
+                "std": float(values.std()),
+                "min": float(values.min()),
+                "max": float(values.max()),
+            }
+        group["metrics"] = metrics
+        summary.append(group)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Barrido paralelo de parámetros de TrafficModel")
+    parser.add_argument("--grid", default="{}", help='JSON {"parámetro": [valores]}')
+    parser.add_argument("--seeds", type=int, default=10, help="semillas por combinación")
+    parser.add_argument("--seed-start", type=int, default=0)
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=None, help="procesos (por defecto todos los núcleos)")
+    parser.add_argument("--out", default=None, help="escribir cada corrida como una línea JSON en este archivo")
+    parser.add_argument("--metrics", default="parked,angry,avg_wait,steps_per_second",
+                        help="métricas a mostrar en la tabla final")
+    parser.add_argument("--json", action="store_true", help="imprimir el resumen como JSON")
+    args = parser.parse_args(argv)
+
+    grid = json.loads(args.grid)
+    seeds = range(args.seed_start, args.seed_start + args.seeds)
+    total = len(expand_grid(grid)) * len(seeds)
+    workers = args.workers or os.cpu_count()
+
+    results = []
+    out = open(args.out, "w", encoding="utf-8") if args.out else None
+    try:
+        for done, result in enumerate(sweep(grid, seeds, args.steps, workers), 1):
+            results.append(result)
+            if out:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+            if "error" in result:
+                print(f"corrida {result['params']} semilla {result['seed']}: {result['error']}", file=sys.stderr)
+            print(f"\r{done}/{total} corridas", end="", file=sys.stderr, flush=True)
+    finally:
+        print(file=sys.stderr)
+        if out:
+            out.close()
+
+    summary = aggregate(results)
+    if args.json:
+        print(json.dumps(summary))
+        return
+    names = args.metrics.split(",")
+    for group in summary:
+        columns = [f"{name}={group['metrics'][name]['mean']:.3f}±{group['metrics'][name]['std']:.3f}"
+                   for name in names if name in group["metrics"]]
+        print(f"{json.dumps(group['params'], sort_keys=True)} runs={group['runs']} errors={group['errors']} "
+              + " ".join(columns))
+
+
+if __name__ == '__main__':
+    main()